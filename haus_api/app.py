@@ -12,7 +12,9 @@ from util import *
 from models import *
 from controllers import *
 from litestar.channels import ChannelsPlugin
-from litestar.channels.backends.memory import MemoryChannelsBackend
+from litestar.config.app import AppConfig
+from litestar.plugins import InitPluginProtocol
+from contextlib import asynccontextmanager
 
 
 @get("/")
@@ -35,13 +37,11 @@ async def depends_context(state: State) -> GlobalContext:
 
 
 async def depends_session(request: Request) -> Session:
-    return await Session.get(request.cookies.get("auth-token", "no-token"))
+    return await load_session(request, persist=True)
 
 
 async def depends_network_security(context: GlobalContext, request: Request) -> int:
-    access = calculate_access_level(
-        request.client.host, context.config.server.security.access_levels
-    )
+    access = context.access.level(request.client.host)
 
     if access == AccessLevel.FORBIDDEN:
         raise NotAuthorizedException(
@@ -51,9 +51,21 @@ async def depends_network_security(context: GlobalContext, request: Request) ->
     return access.value
 
 
-async def startup_tasks(app: Litestar) -> None:
+@asynccontextmanager
+async def context_lifespan(app: Litestar) -> AsyncGenerator[None, None]:
     app.state.context = GlobalContext(app.plugins.get(ChannelsPlugin))
     await app.state.context.initialize()
+    try:
+        yield
+    finally:
+        await handle_shutdown(app)
+
+
+class ContextPlugin(InitPluginProtocol):
+    # Registered after ChannelsPlugin so the context starts after & stops before channels
+    def on_app_init(self, app_config: AppConfig) -> AppConfig:
+        app_config.lifespan.append(context_lifespan)
+        return app_config
 
 
 def internal_server_error_handler(request: Request, exc: Exception) -> Response:
@@ -67,8 +79,13 @@ def internal_server_error_handler(request: Request, exc: Exception) -> Response:
 
 async def handle_shutdown(app: Litestar) -> None:
     context: GlobalContext = app.state.context
+    await context.plugins.unwatch()
     for p in context.plugins.plugins.values():
         await p.close()
+    await context.plugins.stop_hosts()
+    await context.close()
+    await context.renewals.stop()
+    context.credentials.close()
 
 
 app = Litestar(
@@ -80,9 +97,10 @@ app = Litestar(
         UsersSelfController,
         PluginsController,
         SpecificPluginController,
+        ServerController,
+        EventsController,
     ],
     state=State({"context": None}),
-    on_startup=[startup_tasks],
     dependencies={
         "context": Provide(depends_context),
         "session": Provide(depends_session),
@@ -92,12 +110,11 @@ app = Litestar(
     exception_handlers={500: internal_server_error_handler},
     plugins=[
         ChannelsPlugin(
-            backend=MemoryChannelsBackend(history=20),
+            backend=build_channels_backend(
+                RuntimeConfig.from_config("config.yaml").channels
+            ),
             arbitrary_channels_allowed=True,
-            create_ws_route_handlers=True,
-            ws_handler_base_path="/events",
-            ws_handler_send_history=10,
-        )
+        ),
+        ContextPlugin(),
     ],
-    on_shutdown=[handle_shutdown]
 )
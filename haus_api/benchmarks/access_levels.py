@@ -0,0 +1,57 @@
+"""Compare calculate_access_level against the compiled AccessTable.
+
+Run from haus_api/: python -m benchmarks.access_levels [cidr_count]
+"""
+
+import random
+import sys
+from timeit import timeit
+from models import ServerSecurityAccessLevelsConfig
+from util.access import AccessTable, calculate_access_level
+
+
+def build_config(count: int) -> ServerSecurityAccessLevelsConfig:
+    rnd = random.Random(0)
+    nets = [
+        f"10.{rnd.randrange(256)}.{rnd.randrange(256)}.0/{rnd.choice([24, 28, 32])}"
+        for _ in range(count)
+    ]
+    third = count // 3
+    return ServerSecurityAccessLevelsConfig(
+        internal=nets[:third],
+        privileged=nets[third : 2 * third],
+        external=nets[2 * third :] + ["192.168.0.0/16"],
+    )
+
+
+def main(count: int = 120, iterations: int = 100) -> None:
+    config = build_config(count)
+    rnd = random.Random(1)
+    hosts = [f"192.168.{rnd.randrange(256)}.{rnd.randrange(256)}" for _ in range(64)]
+    table = AccessTable(config)
+    uncached = AccessTable(config, cache_size=0)
+
+    for host in hosts:
+        assert table.level(host) == calculate_access_level(host, config)
+
+    results = {
+        "calculate_access_level": timeit(
+            lambda: [calculate_access_level(h, config) for h in hosts],
+            number=iterations,
+        ),
+        "AccessTable (uncached)": timeit(
+            lambda: [uncached.level(h) for h in hosts], number=iterations
+        ),
+        "AccessTable (cached)": timeit(
+            lambda: [table.level(h) for h in hosts], number=iterations
+        ),
+    }
+
+    lookups = iterations * len(hosts)
+    print(f"{count} CIDRs, {lookups} lookups")
+    for name, elapsed in results.items():
+        print(f"  {name:<24} {elapsed / lookups * 1e6:8.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 120)
@@ -0,0 +1,131 @@
+"""Publish latency against subscriber count, before and after encoding once per publish.
+
+Measures the time from publishing one plugin event until every session's
+websocket frame is encoded, through ChannelsPlugin, EventLog & the encoders.
+
+"before" is the path this change replaced: the event was published as a dict,
+which ChannelsPlugin serialized to JSON once. Each session's stream spliced its
+`seq` into that JSON, and every socket converted the resulting frame to its
+encoding. "after" publishes JSON bytes and each encoding converts a payload
+once for all sockets, only splicing in the `seq`.
+
+JSON frames were already serialized once before, so only the msgpack & cbor
+columns are expected to improve, more so for larger events.
+
+Run from haus_api/: python -m benchmarks.event_publish [max_subscribers]
+"""
+
+import asyncio
+import sys
+from statistics import median
+from time import perf_counter
+from litestar.channels import ChannelsPlugin
+from litestar.channels.backends.memory import MemoryChannelsBackend
+from util.event_encoding import ENCODERS, EventEncoder
+from util.event_log import EventLog, Published
+from util.events import Event
+from util.runtime_config import EventStreamConfig
+from util.subscribers import SubscriberRegistry
+
+EVENT = {
+    "plugin": "hass",
+    "new_state": {
+        "id": "light.living_room",
+        "name": "Living Room",
+        "state": "on",
+        "attributes": {"brightness": 180, "color_temp": 370, "rgb": [255, 214, 170]},
+    },
+}
+
+
+# A state with many attributes, like a media player or climate entity
+LARGE_EVENT = {
+    **EVENT,
+    "new_state": {
+        **EVENT["new_state"],
+        "attributes": {
+            f"attribute_{i}": {"value": i, "label": "Attribute", "history": [i] * 10}
+            for i in range(40)
+        },
+    },
+}
+
+
+def publish_before(channels: ChannelsPlugin, sessions: list[str], data: dict) -> None:
+    channels.publish(Event(code="plugin.event", data=data).model_dump(), sessions)
+
+
+def encode_before(encoder: EventEncoder, seq: int, payload: bytes) -> None:
+    encoder.convert(b'{"seq":%d,%s' % (seq, payload[1:]))
+
+
+def publish_after(channels: ChannelsPlugin, sessions: list[str], data: dict) -> None:
+    event = Event(code="plugin.event", data=data)
+    channels.publish(Published.pack(event.model_dump_json().encode()), sessions)
+
+
+def encode_after(encoder: EventEncoder, seq: int, payload: bytes) -> None:
+    encoder.encode(seq, payload)
+
+
+async def measure(
+    count: int, encoder: EventEncoder, after: bool, data: dict, publishes: int
+) -> float:
+    publish, encode = (
+        (publish_after, encode_after) if after else (publish_before, encode_before)
+    )
+    channels = ChannelsPlugin(
+        backend=MemoryChannelsBackend(), arbitrary_channels_allowed=True
+    )
+    async with channels:
+        log = EventLog(EventStreamConfig(), channels, SubscriberRegistry())
+        sessions = [f"session-{i}" for i in range(count)]
+        listeners = []
+        for session in sessions:
+            listener, _ = log.listen(await log.attach(session, "user", ["root"]), None)
+            listeners.append(listener)
+
+        timings = []
+        for _ in range(publishes):
+            start = perf_counter()
+            publish(channels, sessions, data)
+            for listener in listeners:
+                encode(encoder, *(await listener.get()))
+            timings.append(perf_counter() - start)
+
+        await log.stop()
+    return median(timings)
+
+
+def main(max_subscribers: int = 1000, publishes: int = 20) -> None:
+    counts = [c for c in (1, 10, 50, 200, 1000, 5000) if c <= max_subscribers]
+    encoders = []
+    for name, encoder in ENCODERS.items():
+        try:
+            encoder()
+            encoders.append(encoder)
+        except ImportError:
+            print(f"Skipping {name}, its package is not installed.")
+
+    for label, data in (("small event", EVENT), ("large event", LARGE_EVENT)):
+        size = len(Event(code="plugin.event", data=data).model_dump_json())
+        print(f"\n{label} ({size} bytes), median per publish")
+        print(
+            f"{'subscribers':>11}"
+            + "".join(
+                f"{e.name + ' ' + when:>18}"
+                for e in encoders
+                for when in ("before", "after")
+            )
+        )
+        for count in counts:
+            row = [
+                asyncio.run(measure(count, encoder(), after, data, publishes))
+                for encoder in encoders
+                for after in (False, True)
+            ]
+            print(f"{count:>11}" + "".join(f"{r * 1000:>15.3f} ms" for r in row))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
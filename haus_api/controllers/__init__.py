@@ -1,2 +1,4 @@
 from .users import UsersController, UnauthenticatedUsersController, UsersSelfController
 from .plugins import PluginsController, SpecificPluginController
+from .server import ServerController
+from .events import EventsController
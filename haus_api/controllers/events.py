@@ -0,0 +1,206 @@
+import json
+from asyncio import create_task, sleep, timeout
+from time import monotonic
+from typing import AsyncGenerator, Optional
+from litestar import Controller, WebSocket, get, websocket
+from litestar.di import Provide
+from litestar.exceptions import NotAuthorizedException
+from litestar.params import Parameter
+from litestar.response import Stream
+from litestar.status_codes import WS_1008_POLICY_VIOLATION
+from util import *
+
+# Frames sent in one SSE chunk when several are queued at once
+SSE_CHUNK_FRAMES = 256
+
+
+def acknowledge_topics(
+    context: GlobalContext, log: ChannelLog, listener: Listener, rejected: list[str]
+) -> None:
+    # A control frame, not part of the session's stream, so it has no seq
+    context.event_log.offer(
+        log,
+        listener,
+        (
+            None,
+            Event(
+                code="events.topics",
+                data={"topics": listener.topic_list(), "rejected": rejected},
+            )
+            .model_dump_json()
+            .encode(),
+        ),
+    )
+
+
+def update_topics(
+    context: GlobalContext,
+    session_id: str,
+    log: ChannelLog,
+    listener: Listener,
+    subscribe: list[str],
+    unsubscribe: list[str],
+) -> None:
+    listener.unsubscribe(unsubscribe)
+    accepted, rejected = context.subscribers.check_topics(session_id, subscribe)
+    listener.subscribe(accepted)
+    acknowledge_topics(context, log, listener, rejected)
+
+
+class EventsController(Controller):
+    path = "/events"
+
+    @websocket("/{session_id:str}")
+    async def session_events(
+        self,
+        socket: WebSocket,
+        session_id: str,
+        context: GlobalContext,
+        since: Optional[int] = None,
+        topics: Optional[str] = None,
+    ) -> None:
+        session = await load_session(socket)
+        if not session or session.id != session_id:
+            await socket.close(code=WS_1008_POLICY_VIOLATION)
+            return
+
+        user = await load_user(socket)
+        encoder, subprotocol = context.encodings.negotiate(socket)
+        await socket.accept(subprotocols=subprotocol)
+        log = await context.event_log.attach(
+            session_id, session.user_id, user.scopes if user else (), session.expire_at
+        )
+        # Topics only apply to this connection, the backlog is filtered by them too
+        accepted, rejected = context.subscribers.check_topics(
+            session_id, topics.split(",") if topics else []
+        )
+        listener, backlog = context.event_log.listen(log, since, accepted)
+        encoder.connections += 1
+
+        if topics:
+            acknowledge_topics(context, log, listener, rejected)
+
+        async def forward():
+            for seq, payload in backlog:
+                await encoder.send(socket, seq, payload)
+            while True:
+                frame = await listener.get()
+                if isinstance(frame, int):
+                    # Stream ended by the server (revoked, expired or idle)
+                    await socket.close(code=frame)
+                    return
+                await encoder.send(socket, *frame)
+
+        # Any client message counts as activity, clients answer heartbeats with e.g. "{}"
+        last_seen = monotonic()
+
+        async def heartbeat():
+            while True:
+                await sleep(context.runtime.events.heartbeat_interval)
+                if not context.event_log.heartbeat(listener, monotonic() - last_seen):
+                    return
+
+        sender = create_task(forward())
+        pinger = (
+            create_task(heartbeat())
+            if context.runtime.events.heartbeat_interval
+            else None
+        )
+        try:
+            while True:
+                message = await socket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+
+                last_seen = monotonic()
+
+                # {"subscribe": [topic, ...], "unsubscribe": [topic, ...]}
+                try:
+                    request = json.loads(message.get("text") or message.get("bytes"))
+                    if "subscribe" not in request and "unsubscribe" not in request:
+                        continue
+                    update_topics(
+                        context,
+                        session_id,
+                        log,
+                        listener,
+                        [str(t) for t in request.get("subscribe", [])],
+                        [str(t) for t in request.get("unsubscribe", [])],
+                    )
+                except (ValueError, TypeError, AttributeError):
+                    continue
+        finally:
+            sender.cancel()
+            if pinger:
+                pinger.cancel()
+            encoder.connections -= 1
+            context.event_log.unlisten(log, listener)
+
+    @get(
+        "/{session_id:str}/stream",
+        dependencies={"user": Provide(depends_user)},
+        media_type="text/event-stream",
+    )
+    async def session_event_stream(
+        self,
+        session_id: str,
+        session: Session,
+        user: User,
+        context: GlobalContext,
+        since: Optional[int] = None,
+        topics: Optional[str] = None,
+        last_event_id: Optional[int] = Parameter(header="Last-Event-ID", default=None),
+    ) -> Stream:
+        """Read-only Server-Sent Events version of the websocket, resumed with `Last-Event-ID`."""
+        if session.id != session_id:
+            raise NotAuthorizedException(**build_error("access.sessionRequired"))
+
+        encoder = context.encodings.sse
+        log = await context.event_log.attach(
+            session_id, session.user_id, user.scopes, session.expire_at
+        )
+        accepted, rejected = context.subscribers.check_topics(
+            session_id, topics.split(",") if topics else []
+        )
+        listener, backlog = context.event_log.listen(
+            log, last_event_id if last_event_id is not None else since, accepted
+        )
+        encoder.connections += 1
+        if topics:
+            acknowledge_topics(context, log, listener, rejected)
+
+        async def stream() -> AsyncGenerator[str, None]:
+            interval = context.runtime.events.heartbeat_interval or None
+            try:
+                if len(backlog) > 0:
+                    yield "".join(encoder.encode(seq, p) for seq, p in backlog)
+                while True:
+                    try:
+                        async with timeout(interval):
+                            frames = [await listener.get()]
+                    except TimeoutError:
+                        # Comment line, keeps proxies from closing the idle response
+                        context.event_log.heartbeats += 1
+                        yield ":\n\n"
+                        continue
+
+                    # Everything already queued goes out as one chunk
+                    while len(frames) < SSE_CHUNK_FRAMES and not listener.empty():
+                        frames.append(listener.get_nowait())
+
+                    chunk = [
+                        encoder.encode(*f) for f in frames if not isinstance(f, int)
+                    ]
+                    if len(chunk) > 0:
+                        yield "".join(chunk)
+                    if any(isinstance(f, int) for f in frames):
+                        # Ended by the server, revoked or expired
+                        return
+            finally:
+                encoder.connections -= 1
+                context.event_log.unlisten(log, listener)
+
+        return Stream(
+            stream,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
@@ -19,11 +19,12 @@ class PluginsController(Controller):
     async def get_plugin_info(
         self, context: GlobalContext, user: User
     ) -> list[RedactedMetaPlugin]:
+        index = scope_index(user)
         return [
             i.redacted
             for i in await MetaPlugin.all().to_list()
             if i.id in context.plugins.plugins.keys()
-            and user.has_scope(f"app.plugins.{i.id}")
+            and index.has(f"app.plugins.{i.id}")
             and i.active
         ]
 
@@ -31,16 +32,17 @@ class PluginsController(Controller):
     async def get_plugin_detailed_info(
         self, context: GlobalContext, user: User
     ) -> list[MetaPlugin]:
+        index = scope_index(user)
         return [
             i
             for i in await MetaPlugin.all().to_list()
             if i.id in context.plugins.plugins.keys()
-            and user.has_scope(f"app.plugins.{i.id}")
+            and index.has(f"app.plugins.{i.id}")
         ]
 
     @get("/{name:str}")
     async def get_plugin(self, name: str, user: User) -> RedactedMetaPlugin:
-        if not user.has_scope(f"app.plugins.{name}"):
+        if not scope_index(user).has(f"app.plugins.{name}"):
             raise NotFoundException(**build_error("plugin.notFound"))
         result = await MetaPlugin.get(name)
         if not result or not result.active:
@@ -50,7 +52,7 @@ class PluginsController(Controller):
 
     @get("/{name:str}/detailed", guards=[guard_has_scope("plugins.view")])
     async def get_plugin_detailed(self, name: str, user: User) -> MetaPlugin:
-        if not user.has_scope(f"app.plugins.{name}"):
+        if not scope_index(user).has(f"app.plugins.{name}"):
             raise NotFoundException(**build_error("plugin.notFound"))
         result = await MetaPlugin.get(name)
         if not result:
@@ -68,9 +70,11 @@ class PluginsController(Controller):
 
         plugin.settings = data
         await plugin.save()
-        meta, _ = await context.plugins.load_plugin(plugin.manifest, plugin.folder)
+        meta, _ = await context.plugins.reload_plugin(plugin.manifest, plugin.folder)
         await context.post_event(
-            "plugins", data={"target": meta.id, "method": "settings"}
+            "plugins",
+            data={"target": meta.id, "method": "settings"},
+            topic=f"plugins.{meta.id}",
         )
         return meta
 
@@ -84,7 +88,11 @@ class PluginsController(Controller):
 
         plugin.active = data["active"]
         await plugin.save()
-        await context.post_event("plugins", data={"target": name, "method": "active"})
+        await context.post_event(
+            "plugins",
+            data={"target": name, "method": "active"},
+            topic=f"plugins.{name}",
+        )
         return plugin
 
     @post("/{name:str}/reload", guards=[guard_has_scope("plugins.manage.settings")])
@@ -93,15 +101,12 @@ class PluginsController(Controller):
         if not plugin:
             raise NotFoundException(**build_error("plugin.notFound"))
 
-        await context.plugins.plugins[name].close()
-        meta, plugin = await context.plugins.load_plugin(plugin.manifest, plugin.folder)
-        if meta.status and not plugin:
-            request.logger.error(f"Failed to load plugin {
-                                 meta.id}: {meta.status}")
-            context.plugins.plugins[meta.id] = None
-        else:
-            context.plugins.plugins[meta.id] = plugin
-        await context.post_event("plugins", data={"target": name, "method": "reload"})
+        await context.plugins.reload_plugin(plugin.manifest, plugin.folder)
+        await context.post_event(
+            "plugins",
+            data={"target": name, "method": "reload"},
+            topic=f"plugins.{name}",
+        )
         return await MetaPlugin.get(name)
 
 
@@ -122,22 +127,25 @@ class SpecificPluginController(Controller):
     async def get_entities(
         self, plugin: Plugin, context: GlobalContext, ids: Optional[list[str]] = None
     ) -> list[PluginEntity]:
-        await context.plugins.lock(plugin.config.metadata.name)
-        result = await plugin.get_entities(ids=ids)
-        context.plugins.unlock(plugin.config.metadata.name)
+        async with context.plugins.access(
+            plugin.config.metadata.name, "get_entities"
+        ):
+            result = await plugin.get_entities(ids=ids)
         return result
 
     @get("/actions")
     async def get_actions(
         self, plugin: Plugin, context: GlobalContext, ids: Optional[list[str]] = None
     ) -> list[EntityAction]:
-        await context.plugins.lock(plugin.config.metadata.name)
-        result = await plugin.get_actions(ids=ids)
-        context.plugins.unlock(plugin.config.metadata.name)
+        async with context.plugins.access(
+            plugin.config.metadata.name, "get_actions"
+        ):
+            result = await plugin.get_actions(ids=ids)
         return result
 
     @post("/actions/{actionId:str}")
     async def call_action(self, plugin: Plugin, context: GlobalContext, actionId: str, data: PluginActionCall) -> None:
-        await context.plugins.lock(plugin.config.metadata.name)
-        await plugin.call_action(actionId, data.target, data.fields)
-        context.plugins.unlock(plugin.config.metadata.name)
+        async with context.plugins.access(
+            plugin.config.metadata.name, "call_action"
+        ):
+            await plugin.call_action(actionId, data.target, data.fields)
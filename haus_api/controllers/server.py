@@ -0,0 +1,28 @@
+from litestar import Controller, get
+from util import *
+
+
+class ServerController(Controller):
+    path = "/server"
+    guards = [guard_has_scope("server.view")]
+
+    @get("/metrics")
+    async def get_metrics(self, context: GlobalContext) -> dict:
+        return {
+            "sessions": {
+                "cache": context.sessions.stats(),
+                "renewal": context.renewals.stats(),
+                "tokens": context.tokens.stats(),
+            },
+            "auth": context.auth_stats.stats(),
+            "access": context.access.stats(),
+            "credentials": context.credentials.stats(),
+            "subscribers": context.subscribers.stats(),
+            "plugin_events": context.plugins.event_stats(),
+            "plugin_loading": context.plugins.load_stats(),
+            "plugin_calls": context.plugins.call_stats(),
+            "events": {
+                "encodings": context.encodings.stats(),
+                "log": context.event_log.stats(),
+            },
+        }
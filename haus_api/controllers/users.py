@@ -21,19 +21,22 @@ class UnauthenticatedUsersController(Controller):
     path = "/users/auth"
 
     @post("/login")
-    async def login(self, data: UserLoginModel, session: Session) -> RedactedUser:
+    async def login(
+        self, data: UserLoginModel, session: Session, context: GlobalContext
+    ) -> RedactedUser:
         result = await User.find_one(User.username == data.username)
         if not result:
             raise NotFoundException(**build_error("auth.login.notFound"))
 
-        if not result.verify(data.password):
+        if not await context.credentials.verify(result, data.password):
             raise NotFoundException(**build_error("auth.login.notFound"))
 
-        if not result.within_scope("app"):
+        if not scope_index(result).within("app"):
             raise NotFoundException(**build_error("auth.login.notFound"))
 
         session.user_id = result.id
-        await session.save()
+        await context.sessions.save(session)
+        context.subscribers.set_user(session.id, result.id, result.scopes)
         return result.redacted
 
 
@@ -47,9 +50,12 @@ class UsersSelfController(Controller):
         return user.redacted
 
     @post("/logout")
-    async def logout(self, session: Session) -> None:
+    async def logout(self, session: Session, context: GlobalContext) -> None:
+        context.tokens.revoke(session.id)
         session.user_id = None
-        await session.save()
+        await context.sessions.save(session)
+        context.subscribers.set_user(session.id, None)
+        context.subscribers.revoke([session.id])
 
 
 class UsersController(Controller):
@@ -71,10 +77,12 @@ class UsersController(Controller):
                 **build_error("users.create.usernameExists")
             )
 
-        new_user = User.create(data.username, data.password)
+        new_user = await context.credentials.create_user(data.username, data.password)
         new_user.scopes = data.scopes[:]
         await new_user.save()
-        await context.post_event("users", user_ids=[user.id], data={"method": "add"})
+        await context.post_event(
+            "users", user_ids=[user.id], data={"method": "add"}, topic="users"
+        )
         return new_user.redacted
 
     @post("/{user_id:str}/scopes", guards=[guard_has_scope("users.manage.edit")])
@@ -88,13 +96,18 @@ class UsersController(Controller):
         if "root" in result.scopes:
             raise NotAuthorizedException(**build_error("users.immutable"))
 
-        if not all([user.has_scope(i) for i in data]):
+        index = scope_index(user)
+        if not all([index.has(i) for i in data]):
             raise NotAuthorizedException(**build_error("users.edit.scope.insufficient"))
 
         result.scopes = data[:]
         await result.save()
+        context.subscribers.set_scopes(result.id, result.scopes)
         await context.post_event(
-            "users", user_ids=[user.id, result.id], data={"method": "edit"}
+            "users",
+            user_ids=[user.id, result.id],
+            data={"method": "edit"},
+            topic="users",
         )
         return result.redacted
 
@@ -111,6 +124,12 @@ class UsersController(Controller):
 
         await result.delete()
         await context.post_event(
-            "users", user_ids=[user.id, result.id], data={"method": "delete"}
+            "users",
+            user_ids=[user.id, result.id],
+            data={"method": "delete"},
+            topic="users",
         )
         await Session.find(Session.user_id == result.id).delete()
+        context.sessions.invalidate_user(result.id)
+        context.tokens.revoke_user(result.id)
+        context.subscribers.remove_user(result.id)
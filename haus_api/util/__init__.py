@@ -1,9 +1,25 @@
 from .global_context import GlobalContext
-from .session_middleware import SessionMiddleware
+from .session_middleware import (
+    SessionMiddleware,
+    RequestAuth,
+    RequestAuthStats,
+    load_session,
+    load_user,
+)
+from .session_cache import SessionCache
+from .session_renewal import SessionRenewer
+from .session_tokens import SessionTokenSigner, SessionClaims
+from .runtime_config import RuntimeConfig
 from .enums import *
 from .access import *
 from .errors import build_error
 from .dependencies import *
 from .plugin_loader import PluginLoader, MetaPlugin, RedactedMetaPlugin
 from .guards import *
+from .scopes import ScopeIndex, scope_index
+from .credentials import CredentialWorker
+from .subscribers import SubscriberRegistry
+from .channels_backend import UnixSocketChannelsBackend, build_channels_backend
+from .event_encoding import EventEncoder, EventEncodings
+from .event_log import EventLog, ChannelLog, Listener, Published
 from .events import *
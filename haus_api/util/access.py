@@ -1,4 +1,7 @@
 import ipaddress
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Union
 from .enums import AccessLevel
 from models import ServerSecurityAccessLevelsConfig
 
@@ -37,3 +40,81 @@ def calculate_access_level(
             return AccessLevel.EXTERNAL
 
     return AccessLevel.FORBIDDEN
+
+
+class AccessTable:
+    FAMILY_BOUNDS = {4: (1 << 32) - 1, 6: (1 << 128) - 1}
+
+    def __init__(
+        self, access_levels: ServerSecurityAccessLevelsConfig, cache_size: int = 4096
+    ) -> None:
+        ranges: dict[int, list[tuple[int, int, int]]] = {4: [], 6: []}
+        for level, nets in [
+            (AccessLevel.INTERNAL, access_levels.internal),
+            (AccessLevel.PRIVILEGED, access_levels.privileged),
+            (AccessLevel.EXTERNAL, access_levels.external),
+        ]:
+            for net in nets:
+                if net == "*":
+                    for family, top in self.FAMILY_BOUNDS.items():
+                        ranges[family].append((0, top, level.value))
+                    continue
+
+                parsed = (
+                    ipaddress.ip_network(net)
+                    if "/" in net
+                    else ipaddress.ip_network(ipaddress.ip_address(net))
+                )
+                ranges[parsed.version].append(
+                    (
+                        int(parsed.network_address),
+                        int(parsed.broadcast_address),
+                        level.value,
+                    )
+                )
+
+        self.tables = {family: self.flatten(r) for family, r in ranges.items()}
+        self.level = lru_cache(maxsize=cache_size)(self.lookup)
+
+    @staticmethod
+    def flatten(
+        ranges: list[tuple[int, int, int]],
+    ) -> tuple[list[int], list[int], list[int]]:
+        # Split overlapping ranges into disjoint segments, keeping the most
+        # privileged level, which matches the ordering of calculate_access_level
+        bounds = sorted({b for start, end, _ in ranges for b in (start, end + 1)})
+        starts, ends, levels = [], [], []
+        for start, next_start in zip(bounds, bounds[1:]):
+            covering = [lvl for s, e, lvl in ranges if s <= start and e >= start]
+            if not covering:
+                continue
+
+            level = min(covering)
+            if levels and levels[-1] == level and ends[-1] + 1 == start:
+                ends[-1] = next_start - 1
+            else:
+                starts.append(start)
+                ends.append(next_start - 1)
+                levels.append(level)
+
+        return starts, ends, levels
+
+    def lookup(self, host: str) -> AccessLevel:
+        address: Union[ipaddress.IPv4Address, ipaddress.IPv6Address] = (
+            normalize_address(host)
+        )
+        starts, ends, levels = self.tables[address.version]
+        value = int(address)
+        index = bisect_right(starts, value) - 1
+        if index >= 0 and value <= ends[index]:
+            return AccessLevel(levels[index])
+        return AccessLevel.FORBIDDEN
+
+    def stats(self) -> dict:
+        info = self.level.cache_info()
+        return {
+            "ranges": sum(len(t[0]) for t in self.tables.values()),
+            "cache_size": info.currsize,
+            "hits": info.hits,
+            "misses": info.misses,
+        }
@@ -0,0 +1,65 @@
+import re
+from functools import lru_cache
+from typing import Optional
+from litestar.types import Message, Scope
+from .cookies import Cookie, Cookies
+
+AUTH_COOKIE = "auth-token"
+_AUTH_PREFIX = f"{AUTH_COOKIE}=".encode()
+_SAFE_VALUE = re.compile(r"[A-Za-z0-9_\-.]+")
+
+
+def find_cookie(header: bytes, prefix: bytes = _AUTH_PREFIX) -> Optional[str]:
+    start = 0
+    while True:
+        index = header.find(prefix, start)
+        if index < 0:
+            return None
+
+        if index == 0 or header[index - 1] in b"; ":
+            end = header.find(b";", index)
+            value = header[index + len(prefix) : end if end >= 0 else None]
+            return value.strip().decode("latin-1")
+        start = index + 1
+
+
+def read_auth_cookie(scope: Scope) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == b"cookie":
+            return find_cookie(value)
+    return None
+
+
+def replace_auth_cookie(scope: Scope, value: str) -> None:
+    cookie = f"{AUTH_COOKIE}={value}".encode("latin-1")
+    headers = []
+    for key, header in scope["headers"]:
+        if key == b"cookie":
+            others = [
+                part.strip()
+                for part in header.split(b";")
+                if part.strip() and not part.strip().startswith(_AUTH_PREFIX)
+            ]
+            cookie = b"; ".join([*others, cookie])
+        else:
+            headers.append((key, header))
+
+    headers.append((b"cookie", cookie))
+    scope["headers"] = headers
+
+
+@lru_cache(maxsize=4096)
+def set_cookie_header(value: str) -> bytes:
+    if _SAFE_VALUE.fullmatch(value):
+        return b"".join((_AUTH_PREFIX, value.encode(), b"; Path=/"))
+
+    response_cookies = Cookies()
+    response_cookies.add(Cookie(AUTH_COOKIE, value, path="/"))
+    return "; ".join(response_cookies.render_response()).encode("latin-1")
+
+
+def add_auth_cookie(message: Message, value: str) -> None:
+    headers = message.get("headers")
+    if not isinstance(headers, list):
+        headers = message["headers"] = list(headers or [])
+    headers.append((b"set-cookie", set_cookie_header(value)))
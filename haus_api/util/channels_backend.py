@@ -0,0 +1,299 @@
+import fcntl
+import os
+import struct
+from asyncio import (
+    Future,
+    IncompleteReadError,
+    Queue,
+    StreamReader,
+    StreamWriter,
+    Task,
+    create_task,
+    get_running_loop,
+    open_unix_connection,
+    sleep,
+    start_unix_server,
+)
+from collections import defaultdict, deque
+from logging import getLogger
+from typing import AsyncGenerator, Iterable, Optional
+from litestar.channels.backends.base import ChannelsBackend
+from litestar.channels.backends.memory import MemoryChannelsBackend
+from .runtime_config import ChannelsConfig
+
+# op, channel length, payload length
+FRAME_HEADER = struct.Struct("!cHI")
+OP_SUBSCRIBE = b"S"
+OP_UNSUBSCRIBE = b"U"
+OP_PUBLISH = b"P"
+OP_HISTORY = b"H"
+OP_HISTORY_REPLY = b"h"
+CHANNEL_SEPARATOR = "\0"
+MAX_CHANNELS_LENGTH = 0xFFFF
+
+
+def encode_frame(op: bytes, channel: str, payload: bytes = b"") -> bytes:
+    name = channel.encode()
+    return FRAME_HEADER.pack(op, len(name), len(payload)) + name + payload
+
+
+def publish_frames(channels: Iterable[str], payload: bytes) -> bytes:
+    # One copy of the payload per batch of channels instead of per channel
+    frames, batch, length = [], [], 0
+    for channel in channels:
+        size = len(channel.encode()) + 1
+        if batch and length + size > MAX_CHANNELS_LENGTH:
+            frames.append(
+                encode_frame(OP_PUBLISH, CHANNEL_SEPARATOR.join(batch), payload)
+            )
+            batch, length = [], 0
+        batch.append(channel)
+        length += size
+    if batch:
+        frames.append(encode_frame(OP_PUBLISH, CHANNEL_SEPARATOR.join(batch), payload))
+    return b"".join(frames)
+
+
+async def read_frame(reader: StreamReader) -> tuple[bytes, str, bytes]:
+    op, name_length, payload_length = FRAME_HEADER.unpack(
+        await reader.readexactly(FRAME_HEADER.size)
+    )
+    channel = (await reader.readexactly(name_length)).decode()
+    return op, channel, await reader.readexactly(payload_length)
+
+
+class UnixSocketBroker:
+    def __init__(self, path: str, history: int, buffer_size: int) -> None:
+        self.path = path
+        self.buffer_size = buffer_size
+        self.logger = getLogger("uvicorn.error")
+        self.history: defaultdict[str, deque[bytes]] = defaultdict(
+            lambda: deque(maxlen=history)
+        )
+        self.history_length = history
+        self.clients: dict[StreamWriter, set[str]] = {}
+        self.server = None
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await start_unix_server(self.handle, path=self.path)
+
+    async def stop(self) -> None:
+        if self.server:
+            self.server.close()
+            self.server = None
+        for writer in list(self.clients.keys()):
+            writer.close()
+
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        channels = self.clients.setdefault(writer, set())
+        try:
+            while True:
+                op, channel, payload = await read_frame(reader)
+                if op == OP_SUBSCRIBE:
+                    channels.add(channel)
+                elif op == OP_UNSUBSCRIBE:
+                    channels.discard(channel)
+                elif op == OP_PUBLISH:
+                    targets = channel.split(CHANNEL_SEPARATOR)
+                    if self.history_length:
+                        for target in targets:
+                            self.history[target].append(payload)
+                    for client, subscribed in self.clients.items():
+                        matching = [t for t in targets if t in subscribed]
+                        if matching and not client.is_closing():
+                            self.send(client, publish_frames(matching, payload))
+                elif op == OP_HISTORY:
+                    request_id, limit = struct.unpack("!II", payload)
+                    entries = list(self.history.get(channel, ()))
+                    if limit:
+                        entries = entries[-limit:]
+                    writer.write(
+                        encode_frame(
+                            OP_HISTORY_REPLY,
+                            channel,
+                            struct.pack("!I", request_id)
+                            + b"".join(struct.pack("!I", len(e)) + e for e in entries),
+                        )
+                    )
+        except (IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.clients[writer]
+            writer.close()
+
+    def send(self, client: StreamWriter, frames: bytes) -> None:
+        # Like Redis' pubsub output buffer limit, a worker that stops reading is
+        # disconnected instead of buffering for it without bound. It reconnects &
+        # resubscribes, events published meanwhile are lost to it.
+        if client.transport.get_write_buffer_size() + len(frames) > self.buffer_size:
+            self.logger.warning("Disconnecting a channels client that fell behind.")
+            # close() would wait for the buffer to flush first
+            client.transport.abort()
+            return
+        client.write(frames)
+
+
+class UnixSocketChannelsBackend(ChannelsBackend):
+    """Shares channels between worker processes on one host.
+
+    The first worker to take the lock file hosts the broker, every worker
+    (including that one) connects to it as a client.
+    """
+
+    def __init__(
+        self, path: str, history: int = 0, buffer_size: int = 16 * 1024 * 1024
+    ) -> None:
+        self.path = path
+        self.history = history
+        self.buffer_size = buffer_size
+        self.channels: set[str] = set()
+        self.queue: Optional[Queue] = None
+        self.broker: Optional[UnixSocketBroker] = None
+        self.lock_file = None
+        self.reader: Optional[StreamReader] = None
+        self.writer: Optional[StreamWriter] = None
+        self.reader_task: Optional[Task] = None
+        self.requests: dict[int, Future] = {}
+        self.next_request = 0
+        self.logger = getLogger("uvicorn.error")
+
+    async def try_host_broker(self) -> None:
+        if self.broker:
+            return
+
+        lock_file = open(self.path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return
+
+        self.lock_file = lock_file
+        self.broker = UnixSocketBroker(self.path, self.history, self.buffer_size)
+        await self.broker.start()
+        self.logger.info(f"Hosting channels broker on {self.path}")
+
+    async def connect(self) -> None:
+        while True:
+            await self.try_host_broker()
+            try:
+                self.reader, self.writer = await open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionError):
+                await sleep(0.1)
+
+        for channel in self.channels:
+            self.writer.write(encode_frame(OP_SUBSCRIBE, channel))
+
+    async def on_startup(self) -> None:
+        self.queue = Queue()
+        await self.connect()
+        self.reader_task = create_task(self.read_loop())
+
+    def fail_requests(self) -> None:
+        for future in self.requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Lost channels broker connection"))
+        self.requests = {}
+
+    async def on_shutdown(self) -> None:
+        self.fail_requests()
+        if self.reader_task:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.writer:
+            self.writer.close()
+        if self.broker:
+            await self.broker.stop()
+            self.broker = None
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
+        self.queue = None
+
+    async def read_loop(self) -> None:
+        while True:
+            try:
+                op, channel, payload = await read_frame(self.reader)
+            except (IncompleteReadError, ConnectionError):
+                self.logger.warning("Lost channels broker connection, reconnecting.")
+                # Replies to requests sent on the old connection never arrive
+                self.fail_requests()
+                await self.connect()
+                continue
+
+            if op == OP_PUBLISH:
+                for target in channel.split(CHANNEL_SEPARATOR):
+                    self.queue.put_nowait((target, payload))
+            elif op == OP_HISTORY_REPLY:
+                (request_id,) = struct.unpack_from("!I", payload)
+                entries, offset = [], 4
+                while offset < len(payload):
+                    (length,) = struct.unpack_from("!I", payload, offset)
+                    entries.append(payload[offset + 4 : offset + 4 + length])
+                    offset += 4 + length
+                future = self.requests.pop(request_id, None)
+                if future and not future.done():
+                    future.set_result(entries)
+
+    async def publish(self, data: bytes, channels: Iterable[str]) -> None:
+        self.writer.write(publish_frames(channels, data))
+
+    async def subscribe(self, channels: Iterable[str]) -> None:
+        for channel in channels:
+            if channel not in self.channels:
+                self.channels.add(channel)
+                self.writer.write(encode_frame(OP_SUBSCRIBE, channel))
+
+    async def unsubscribe(self, channels: Iterable[str]) -> None:
+        for channel in channels:
+            if channel in self.channels:
+                self.channels.discard(channel)
+                self.writer.write(encode_frame(OP_UNSUBSCRIBE, channel))
+
+    async def stream_events(self) -> AsyncGenerator[tuple[str, bytes], None]:
+        while True:
+            channel, message = await self.queue.get()
+            if channel in self.channels:
+                yield channel, message
+
+    async def get_history(
+        self, channel: str, limit: Optional[int] = None
+    ) -> list[bytes]:
+        if not self.history:
+            return []
+
+        self.next_request = (self.next_request + 1) % (1 << 32)
+        future = get_running_loop().create_future()
+        self.requests[self.next_request] = future
+        self.writer.write(
+            encode_frame(
+                OP_HISTORY, channel, struct.pack("!II", self.next_request, limit or 0)
+            )
+        )
+        return await future
+
+
+def build_channels_backend(config: ChannelsConfig) -> ChannelsBackend:
+    # Replay is handled by EventLog, so backends keep no history of their own
+    if config.backend == "unix":
+        return UnixSocketChannelsBackend(
+            config.socket_path, buffer_size=config.broker_buffer_size
+        )
+
+    if config.backend == "redis":
+        try:
+            from redis.asyncio import Redis
+            from litestar.channels.backends.redis import RedisChannelsPubSubBackend
+        except ImportError:
+            raise RuntimeError(
+                "The redis channels backend requires the redis package (pip install redis)"
+            )
+
+        return RedisChannelsPubSubBackend(
+            redis=Redis.from_url(config.redis_url), key_prefix="HAUS_CHANNELS"
+        )
+
+    return MemoryChannelsBackend()
@@ -0,0 +1,72 @@
+from asyncio import Semaphore, get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import monotonic
+from typing import Any, Callable
+from litestar.exceptions import TooManyRequestsException
+from models import User
+from .errors import build_error
+from .runtime_config import CredentialConfig
+
+
+class CredentialWorker:
+    def __init__(self, config: CredentialConfig) -> None:
+        self.config = config
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.workers, thread_name_prefix="haus-credentials"
+        )
+        self.slots = Semaphore(config.workers)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, func: Callable, *args) -> Any:
+        if self.waiting >= self.config.max_queue:
+            self.rejected += 1
+            raise TooManyRequestsException(**build_error("auth.busy"))
+
+        queued_at = monotonic()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        waited = monotonic() - queued_at
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.running += 1
+        try:
+            return await get_running_loop().run_in_executor(
+                self.executor, partial(func, *args)
+            )
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.slots.release()
+
+    async def verify(self, user: User, password: str) -> bool:
+        return await self.run(user.verify, password)
+
+    async def create_user(self, username: str, password: str) -> User:
+        return await self.run(User.create, username, password)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.config.workers,
+            "max_queue": self.config.max_queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "mean_wait_ms": (
+                self.total_wait / self.completed * 1000 if self.completed else 0.0
+            ),
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -1,12 +1,13 @@
+from litestar import Request
 from models import Session, User
 from litestar.exceptions import *
 from .errors import *
+from .session_middleware import load_user
 
 
-async def depends_user(session: Session) -> User:
-    if session.user_id:
-        result = await User.get(session.user_id)
-        if result:
-            return result
+async def depends_user(request: Request) -> User:
+    result = await load_user(request)
+    if result:
+        return result
 
     raise NotAuthorizedException(**build_error("access.loginRequired"))
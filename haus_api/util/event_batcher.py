@@ -0,0 +1,132 @@
+from asyncio import Task, create_task, gather, sleep
+from logging import getLogger
+from time import monotonic
+from typing import Any, Optional, Union
+from .event_queue import QueuedEvent, entity_key
+from .runtime_config import PluginEventConfig
+from .subscribers import entity_topic
+
+
+class PluginEventBatcher:
+    def __init__(self, context, plugin_id: str, config: PluginEventConfig) -> None:
+        self.context = context
+        self.plugin_id = plugin_id
+        self.topic_root = f"plugins.{plugin_id}"
+        self.config = config
+        self.pending: dict[Union[str, int], QueuedEvent] = {}
+        self.timer: Optional[Task] = None
+        # Keeps timers referenced until their flush is done, the timer is cleared before
+        self.tasks: set[Task] = set()
+        self.logger = getLogger("uvicorn.error")
+        self.sequence = 0
+        self.received = 0
+        self.coalesced = 0
+        self.published = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_count = 0
+
+    def key(self, event: dict[str, Any]) -> Union[str, int]:
+        key = entity_key(event)
+        if key:
+            return key
+
+        self.sequence += 1
+        return self.sequence
+
+    async def add(self, item: QueuedEvent) -> None:
+        self.received += 1
+        if self.config.batch_window <= 0:
+            await self.publish([item])
+            return
+
+        key = self.key(item.event)
+        if key in self.pending:
+            # Later state replaces the earlier update & moves to the end of the batch
+            item.received_at = self.pending.pop(key).received_at
+            self.coalesced += 1
+        self.pending[key] = item
+
+        if len(self.pending) >= self.config.batch_size:
+            await self.flush()
+        elif not self.timer:
+            self.timer = create_task(self.flush_later())
+            self.tasks.add(self.timer)
+            self.timer.add_done_callback(self.tasks.discard)
+
+    async def flush_later(self) -> None:
+        await sleep(self.config.batch_window)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        if len(self.pending) == 0:
+            return
+
+        items, self.pending = self.pending, {}
+        try:
+            await self.publish(list(items.values()))
+        except Exception:
+            # Kept for the next flush, updates received meanwhile replace their entity's
+            self.pending = {**items, **self.pending}
+            self.logger.exception(
+                f"Publishing events of plugin {self.plugin_id} failed"
+            )
+
+    def topic(self, item: QueuedEvent) -> str:
+        key = entity_key(item.event)
+        if key:
+            return entity_topic(self.plugin_id, key)
+        return self.topic_root
+
+    async def publish(self, items: list[QueuedEvent]) -> None:
+        if len(items) == 1:
+            await self.context.post_event(
+                "plugin.event",
+                user_ids="*",
+                data=items[0].event,
+                local=True,
+                topic=self.topic(items[0]),
+            )
+        else:
+            # Connections following single entities only receive their part of the batch
+            self.context.publish_event(
+                "plugin.events",
+                {"plugin": self.plugin_id, "events": [i.event for i in items]},
+                self.context.subscribers.channels(
+                    "*", topic=self.topic_root, local=True
+                ),
+                topic=self.topic_root,
+                parts=[self.topic(i) for i in items],
+            )
+
+        self.published += 1
+        now = monotonic()
+        for item in items:
+            latency = now - item.received_at
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        self.latency_count += len(items)
+
+    async def close(self) -> None:
+        await self.flush()
+        # A timer past its window is still publishing its batch
+        await gather(*self.tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "published": self.published,
+            "pending": len(self.pending),
+            "latency_mean_ms": (
+                self.latency_total / self.latency_count * 1000
+                if self.latency_count
+                else 0.0
+            ),
+            "latency_max_ms": self.latency_max * 1000,
+        }
@@ -0,0 +1,168 @@
+import json
+from collections import OrderedDict
+from typing import Any, Optional, Union
+import msgspec
+from litestar import WebSocket
+from .runtime_config import EventStreamConfig
+
+SUBPROTOCOL_PREFIX = "haus."
+BODY_CACHE_SIZE = 64
+
+
+class EventEncoder:
+    """Converts published JSON payloads to one wire encoding.
+
+    Each payload is converted once and shared by every subscriber, only the
+    per-session sequence number is spliced into the frame.
+    """
+
+    name = "json"
+    binary = False
+
+    def __init__(self) -> None:
+        self.bodies: OrderedDict[bytes, Any] = OrderedDict()
+        self.connections = 0
+        self.messages = 0
+        self.encoded = 0
+        self.bytes = 0
+        self.json_bytes = 0
+
+    def convert(self, payload: bytes) -> Any:
+        return payload.decode()
+
+    def with_sequence(self, seq: int, body: Any) -> Union[str, bytes]:
+        return '{"seq":%d,%s' % (seq, body[1:])
+
+    def body(self, payload: bytes) -> Any:
+        # Payloads are shared between channels, so their hash is only computed once
+        body = self.bodies.get(payload)
+        if body is None:
+            body = self.bodies[payload] = self.convert(payload)
+            self.encoded += 1
+            if len(self.bodies) > BODY_CACHE_SIZE:
+                self.bodies.popitem(last=False)
+        return body
+
+    def encode(self, seq: Optional[int], payload: bytes) -> Union[str, bytes]:
+        body = self.body(payload)
+        frame = body if seq is None else self.with_sequence(seq, body)
+        self.messages += 1
+        self.bytes += len(frame)
+        self.json_bytes += len(payload)
+        return frame
+
+    async def send(self, socket: WebSocket, seq: Optional[int], payload: bytes) -> None:
+        frame = self.encode(seq, payload)
+        if self.binary:
+            await socket.send_bytes(frame)
+        else:
+            await socket.send_text(frame)
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "messages": self.messages,
+            "encoded": self.encoded,
+            "bytes": self.bytes,
+            "json_bytes": self.json_bytes,
+        }
+
+
+class SseEventEncoder(EventEncoder):
+    name = "sse"
+
+    def encode(self, seq: Optional[int], payload: bytes) -> str:
+        data = super().encode(seq, payload)
+        frame = f"data: {data}\n\n" if seq is None else f"id: {seq}\ndata: {data}\n\n"
+        self.bytes += len(frame) - len(data)
+        return frame
+
+
+class MsgpackEventEncoder(EventEncoder):
+    name = "msgpack"
+    binary = True
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.decoder = msgspec.json.Decoder()
+        self.encoder = msgspec.msgpack.Encoder()
+
+    def convert(self, payload: bytes) -> bytes:
+        return self.encoder.encode(self.decoder.decode(payload))
+
+    def with_sequence(self, seq: int, body: bytes) -> bytes:
+        # Events are small fixmaps (0x80 | size), add one "seq" entry in front
+        if 0x80 <= body[0] < 0x8F:
+            return b"".join(
+                (
+                    bytes((body[0] + 1,)),
+                    self.encoder.encode("seq"),
+                    self.encoder.encode(seq),
+                    body[1:],
+                )
+            )
+        return self.encoder.encode({"seq": seq, **msgspec.msgpack.decode(body)})
+
+
+class CborEventEncoder(EventEncoder):
+    name = "cbor"
+    binary = True
+
+    def __init__(self) -> None:
+        super().__init__()
+        import cbor2
+
+        self.dumps = cbor2.dumps
+        self.loads = cbor2.loads
+
+    def convert(self, payload: bytes) -> bytes:
+        return self.dumps(json.loads(payload))
+
+    def with_sequence(self, seq: int, body: bytes) -> bytes:
+        # Small maps carry their size in the initial byte (0xa0 | size)
+        if 0xA0 <= body[0] < 0xB7:
+            return b"".join(
+                (bytes((body[0] + 1,)), self.dumps("seq"), self.dumps(seq), body[1:])
+            )
+        return self.dumps({"seq": seq, **self.loads(body)})
+
+
+ENCODERS: dict[str, type[EventEncoder]] = {
+    "json": EventEncoder,
+    "msgpack": MsgpackEventEncoder,
+    "cbor": CborEventEncoder,
+}
+
+
+class EventEncodings:
+    def __init__(self, config: EventStreamConfig) -> None:
+        self.encoders: dict[str, EventEncoder] = {"json": EventEncoder()}
+        self.sse = SseEventEncoder()
+        for name in config.encodings:
+            if name in self.encoders or name not in ENCODERS:
+                continue
+            try:
+                self.encoders[name] = ENCODERS[name]()
+            except ImportError:
+                # Optional encoder library is not installed
+                pass
+
+    def negotiate(self, socket: WebSocket) -> tuple[EventEncoder, Optional[str]]:
+        """Picks the client's preferred encoding, as a `haus.<encoding>` subprotocol or `?encoding=`."""
+        for subprotocol in socket.scope.get("subprotocols") or []:
+            name = subprotocol.removeprefix(SUBPROTOCOL_PREFIX)
+            if subprotocol.startswith(SUBPROTOCOL_PREFIX) and name in self.encoders:
+                return self.encoders[name], subprotocol
+
+        return (
+            self.encoders.get(
+                socket.query_params.get("encoding"), self.encoders["json"]
+            ),
+            None,
+        )
+
+    def stats(self) -> dict:
+        return {
+            **{name: encoder.stats() for name, encoder in self.encoders.items()},
+            "sse": self.sse.stats(),
+        }
@@ -0,0 +1,409 @@
+import json
+from asyncio import Queue, Task, create_task, sleep
+from collections import OrderedDict, deque
+from datetime import datetime
+from time import monotonic
+from typing import Iterable, Optional, Union
+from litestar.channels import ChannelsPlugin
+from litestar.channels.subscriber import Subscriber
+from litestar.status_codes import WS_1001_GOING_AWAY, WS_1008_POLICY_VIOLATION
+from models import Session
+from .events import Event
+from .runtime_config import EventStreamConfig
+from .subscribers import ALL_TOPICS, SubscriberRegistry, topic_matches
+
+RESYNC_EVENT = "events.resync"
+HEARTBEAT_EVENT = "events.heartbeat"
+
+# Published payloads recently unpacked, shared by every session they were sent to
+UNPACKED_SIZE = 64
+
+
+# (seq, payload) pairs, the sequence number is added by the session's encoder
+Frame = tuple[Optional[int], bytes]
+
+# Listeners receive frames, then a websocket close code if the server ends the stream
+ListenerItem = Union[Frame, int]
+
+
+def session_expired(expire_at: datetime) -> bool:
+    return expire_at <= datetime.now(tz=expire_at.tzinfo)
+
+
+class Published:
+    """An event as published to the channels, with the topics listeners filter it by."""
+
+    __slots__ = ("topic", "parts", "payload", "subsets")
+
+    def __init__(
+        self,
+        topic: Optional[str],
+        parts: Optional[tuple[str, ...]],
+        payload: bytes,
+    ) -> None:
+        self.topic = topic
+        # The topic of each event in a batch
+        self.parts = parts
+        self.payload = payload
+        self.subsets: dict[tuple[int, ...], bytes] = {}
+
+    @staticmethod
+    def pack(
+        payload: bytes,
+        topic: Optional[str] = None,
+        parts: Optional[list[str]] = None,
+    ) -> bytes:
+        # "<topic>[\t<part> <part>...]\n<payload>", topics contain no whitespace
+        header = (topic or "") + ("\t" + " ".join(parts) if parts else "")
+        return header.encode() + b"\n" + payload
+
+    @staticmethod
+    def unpack(data: bytes) -> "Published":
+        header, separator, payload = data.partition(b"\n")
+        if not separator:
+            return Published(None, None, data)
+
+        topic, _, parts = header.decode().partition("\t")
+        return Published(
+            topic or None, tuple(parts.split(" ")) if parts else None, payload
+        )
+
+    def subset(self, indexes: tuple[int, ...]) -> bytes:
+        # Encoded once per distinct selection, however many listeners share it
+        if indexes not in self.subsets:
+            event = json.loads(self.payload)
+            event["data"]["events"] = [event["data"]["events"][i] for i in indexes]
+            self.subsets[indexes] = json.dumps(
+                event, separators=(",", ":"), ensure_ascii=False
+            ).encode()
+        return self.subsets[indexes]
+
+
+class Listener(Queue):
+    """Frames waiting to be sent on one websocket or SSE response."""
+
+    def __init__(self, maxsize: int = 0) -> None:
+        super().__init__(maxsize)
+        # Topics this connection follows, None for every topic
+        self.topics: Optional[frozenset[str]] = None
+
+    def subscribe(self, topics: Iterable[str]) -> None:
+        topics = set(topics)
+        if ALL_TOPICS in topics:
+            self.topics = None
+        elif len(topics) > 0:
+            self.topics = (self.topics or frozenset()) | topics
+
+    def unsubscribe(self, topics: Iterable[str]) -> None:
+        topics = set(topics)
+        if ALL_TOPICS in topics:
+            self.topics = frozenset()
+        elif self.topics is not None:
+            # Following everything, single topics can't be excluded
+            self.topics = self.topics - topics
+
+    def topic_list(self) -> list[str]:
+        return [ALL_TOPICS] if self.topics is None else sorted(self.topics)
+
+    def select(self, event: Published) -> Optional[bytes]:
+        """The payload this listener receives for `event`, None if it follows none of it."""
+        if topic_matches(self.topics, event.topic):
+            return event.payload
+        if not event.parts:
+            return None
+
+        # Only following some entities of a batch
+        indexes = tuple(
+            i
+            for i, topic in enumerate(event.parts)
+            if topic_matches(self.topics, topic)
+        )
+        return event.subset(indexes) if len(indexes) > 0 else None
+
+    def clear(self) -> None:
+        while not self.empty():
+            self.get_nowait()
+
+    def close(self, code: int) -> None:
+        # The close code is never dropped, pending frames are
+        if self.full():
+            self.clear()
+        self.put_nowait(code)
+
+
+class ChannelLog:
+    def __init__(
+        self,
+        channel: str,
+        config: EventStreamConfig,
+        expire_at: Optional[datetime] = None,
+    ) -> None:
+        self.channel = channel
+        self.config = config
+        self.expire_at = expire_at
+        self.sequence = 0
+        # Payloads are shared with every other session the event was published to
+        self.entries: deque[tuple[int, float, Published]] = deque(
+            maxlen=config.replay_size
+        )
+        self.listeners: set[Listener] = set()
+        self.detached_at: Optional[float] = None
+        self.subscriber: Optional[Subscriber] = None
+        self.task: Optional[Task] = None
+
+    def append(self, event: Published) -> int:
+        self.sequence += 1
+        if self.config.replay_size and self.config.replay_age:
+            self.entries.append((self.sequence, monotonic(), event))
+        return self.sequence
+
+    def trim(self, now: float) -> None:
+        if self.config.replay_age:
+            cutoff = now - self.config.replay_age
+            while len(self.entries) > 0 and self.entries[0][1] < cutoff:
+                self.entries.popleft()
+
+    def since(self, seq: int, listener: Listener) -> Optional[list[Frame]]:
+        """Frames after `seq` for `listener`'s topics, or None if some of them are no longer retained."""
+        if seq > self.sequence:
+            return None
+        if seq == self.sequence:
+            return []
+
+        self.trim(monotonic())
+        if len(self.entries) == 0 or self.entries[0][0] > seq + 1:
+            return None
+        frames = []
+        for entry_seq, _, event in self.entries:
+            if entry_seq > seq:
+                payload = listener.select(event)
+                if payload is not None:
+                    frames.append((entry_seq, payload))
+        return frames
+
+    def resync(self, seq: Optional[int] = None) -> Frame:
+        seq = self.sequence if seq is None else seq
+        return (
+            seq,
+            Event(code=RESYNC_EVENT, data={"seq": seq}).model_dump_json().encode(),
+        )
+
+
+class EventLog:
+    """Per-session event streams with sequence numbers, kept for `replay_age` after a websocket disconnects."""
+
+    def __init__(
+        self,
+        config: EventStreamConfig,
+        channels: ChannelsPlugin,
+        subscribers: SubscriberRegistry,
+    ) -> None:
+        self.config = config
+        self.channels = channels
+        self.subscribers = subscribers
+        self.logs: dict[str, ChannelLog] = {}
+        self.pruner: Optional[Task] = None
+        self.replayed = 0
+        self.resyncs = 0
+        self.heartbeats = 0
+        self.evicted = 0
+        self.expired = 0
+        self.revoked = 0
+        self.overflows = 0
+        self.tasks: set[Task] = set()
+        self.unpacked: OrderedDict[int, tuple[bytes, Published]] = OrderedDict()
+
+    async def attach(
+        self,
+        channel: str,
+        user_id: Optional[str],
+        scopes: Iterable[str] = (),
+        expire_at: Optional[datetime] = None,
+    ) -> ChannelLog:
+        log = self.logs.get(channel)
+        if not log:
+            log = self.logs[channel] = ChannelLog(channel, self.config, expire_at)
+            log.subscriber = await self.channels.subscribe(channel)
+            log.task = create_task(self.record(log))
+            self.subscribers.connect(channel, user_id, scopes)
+        elif expire_at:
+            log.expire_at = expire_at
+
+        log.detached_at = None
+        return log
+
+    def unpack(self, data: bytes) -> Published:
+        # Sessions receive the same published bytes, unpack them once
+        cached = self.unpacked.get(id(data))
+        if cached and cached[0] is data:
+            return cached[1]
+
+        event = Published.unpack(data)
+        self.unpacked[id(data)] = (data, event)
+        if len(self.unpacked) > UNPACKED_SIZE:
+            self.unpacked.popitem(last=False)
+        return event
+
+    async def record(self, log: ChannelLog) -> None:
+        async for data in log.subscriber.iter_events():
+            event = self.unpack(data)
+            # Every event counts towards the session's seq, filtered or not
+            seq = log.append(event)
+            for listener in log.listeners:
+                payload = listener.select(event)
+                if payload is not None:
+                    self.offer(log, listener, (seq, payload))
+
+    def offer(self, log: ChannelLog, listener: Listener, frame: Frame) -> None:
+        if listener.full():
+            # The client isn't keeping up, drop its backlog and have it refetch state
+            listener.clear()
+            self.overflows += 1
+            # Continue from right before the frame that follows
+            listener.put_nowait(log.resync(frame[0] - 1 if frame[0] else None))
+        listener.put_nowait(frame)
+
+    def background(self, coroutine) -> None:
+        task = create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def listen(
+        self,
+        log: ChannelLog,
+        since: Optional[int],
+        topics: Iterable[str] = (),
+    ) -> tuple[Listener, list[Frame]]:
+        # Room for the resync frame and the frame that overflowed
+        listener = Listener(max(self.config.listener_queue_size, 2))
+        listener.subscribe(topics)
+        log.listeners.add(listener)
+        if since is None:
+            return listener, []
+
+        backlog = log.since(since, listener)
+        if backlog is None:
+            self.resyncs += 1
+            return listener, [log.resync()]
+
+        self.replayed += len(backlog)
+        return listener, backlog
+
+    def unlisten(self, log: ChannelLog, listener: Listener) -> None:
+        log.listeners.discard(listener)
+        if len(log.listeners) == 0:
+            log.detached_at = monotonic()
+            if not self.config.replay_age:
+                # Nothing to resume, don't wait for the next prune
+                self.background(self.close_detached(log))
+
+    def heartbeat(self, listener: Listener, idle: float) -> bool:
+        """Queues a heartbeat, or evicts the connection once the client has been silent for `idle_timeout`."""
+        if self.config.idle_timeout and idle >= self.config.idle_timeout:
+            self.evicted += 1
+            listener.close(WS_1001_GOING_AWAY)
+            return False
+
+        # A full queue is busy sending already
+        if not listener.full():
+            self.heartbeats += 1
+            listener.put_nowait(
+                (None, Event(code=HEARTBEAT_EVENT).model_dump_json().encode())
+            )
+        return True
+
+    def end(self, log: ChannelLog, code: int) -> None:
+        # Closes the session's websockets & drops its stream without waiting for replay_age
+        for listener in log.listeners:
+            listener.close(code)
+        log.listeners.clear()
+        self.background(self.close(log))
+
+    def revoke(self, channels: Iterable[str]) -> None:
+        for channel in channels:
+            log = self.logs.get(channel)
+            if log:
+                self.revoked += 1
+                self.end(log, WS_1008_POLICY_VIOLATION)
+
+    async def check_expiry(self, log: ChannelLog) -> None:
+        # The session may have been renewed since the websocket connected
+        session = await Session.get(log.channel)
+        if not session or session_expired(session.expire_at):
+            self.expired += 1
+            self.end(log, WS_1008_POLICY_VIOLATION)
+        else:
+            log.expire_at = session.expire_at
+
+    async def close(self, log: ChannelLog) -> None:
+        if self.logs.get(log.channel) is not log:
+            return
+
+        del self.logs[log.channel]
+        if log.task:
+            log.task.cancel()
+        if log.subscriber:
+            await self.channels.unsubscribe(log.subscriber)
+        self.subscribers.disconnect(log.channel)
+
+    async def close_detached(self, log: ChannelLog) -> None:
+        # Unless the session reconnected in the meantime
+        if len(log.listeners) == 0:
+            await self.close(log)
+
+    async def prune(self) -> None:
+        now = monotonic()
+        for log in list(self.logs.values()):
+            if log.detached_at is not None and (
+                now - log.detached_at >= self.config.replay_age
+            ):
+                await self.close(log)
+            elif log.expire_at and session_expired(log.expire_at):
+                await self.check_expiry(log)
+            else:
+                log.trim(now)
+
+    async def run(self) -> None:
+        while True:
+            await sleep(max(self.config.replay_age / 4, 1.0))
+            await self.prune()
+
+    def start(self) -> None:
+        if not self.pruner:
+            self.pruner = create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.pruner:
+            self.pruner.cancel()
+            self.pruner = None
+        for log in list(self.logs.values()):
+            await self.close(log)
+
+    def stats(self) -> dict:
+        # Payloads are shared between channels, count each one once
+        payloads = {
+            id(event): len(event.payload)
+            for l in self.logs.values()
+            for _, _, event in l.entries
+        }
+        return {
+            "channels": len(self.logs),
+            "detached": len([l for l in self.logs.values() if l.detached_at]),
+            "listeners": sum(len(l.listeners) for l in self.logs.values()),
+            "topic_listeners": sum(
+                1
+                for l in self.logs.values()
+                for q in l.listeners
+                if q.topics is not None
+            ),
+            "retained": sum(len(l.entries) for l in self.logs.values()),
+            "buffered_bytes": sum(payloads.values()),
+            "queued": sum(q.qsize() for l in self.logs.values() for q in l.listeners),
+            "replayed": self.replayed,
+            "resyncs": self.resyncs,
+            "heartbeats": self.heartbeats,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "revoked": self.revoked,
+            "overflows": self.overflows,
+        }
@@ -0,0 +1,100 @@
+from asyncio import Condition
+from collections import deque
+from time import monotonic
+from typing import Any, Optional
+from .runtime_config import PluginEventConfig
+
+
+def entity_key(event: dict[str, Any]) -> Optional[str]:
+    new_state = event.get("new_state")
+    if isinstance(new_state, dict) and new_state.get("id"):
+        return new_state["id"]
+    return None
+
+
+class QueuedEvent:
+    __slots__ = ("received_at", "event", "key")
+
+    def __init__(self, event: dict[str, Any], key: Optional[str]) -> None:
+        self.received_at = monotonic()
+        self.event = event
+        self.key = key
+
+
+class PluginEventQueue:
+    def __init__(self, config: PluginEventConfig) -> None:
+        self.config = config
+        self.items: deque[QueuedEvent] = deque()
+        self.entities: dict[str, QueuedEvent] = {}
+        self.changed = Condition()
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.closed = False
+
+    def _remove_key(self, item: QueuedEvent) -> None:
+        if item.key and self.entities.get(item.key) is item:
+            del self.entities[item.key]
+
+    async def put(self, event: dict[str, Any]) -> None:
+        self.received += 1
+        key = entity_key(event) if self.config.overflow == "coalesce" else None
+        if key and key in self.entities:
+            # Newer state replaces the queued one, the original age is kept
+            self.entities[key].event = event
+            self.coalesced += 1
+            return
+
+        async with self.changed:
+            if len(self.items) >= self.config.queue_size:
+                if self.config.overflow == "block":
+                    self.blocked += 1
+                    await self.changed.wait_for(
+                        lambda: len(self.items) < self.config.queue_size
+                    )
+                else:
+                    self._remove_key(self.items.popleft())
+                    self.dropped += 1
+
+            item = QueuedEvent(event, key)
+            self.items.append(item)
+            if key:
+                self.entities[key] = item
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.changed.notify_all()
+
+    async def get(self) -> Optional[QueuedEvent]:
+        """The next event, None once the queue is closed and empty."""
+        async with self.changed:
+            await self.changed.wait_for(lambda: len(self.items) > 0 or self.closed)
+            if len(self.items) == 0:
+                return None
+            item = self.items.popleft()
+            self._remove_key(item)
+            self.changed.notify_all()
+            return item
+
+    def drain(self) -> list[QueuedEvent]:
+        items = list(self.items)
+        self.items.clear()
+        self.entities.clear()
+        return items
+
+    async def close(self) -> None:
+        async with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.config.overflow,
+            "size": self.config.queue_size,
+            "depth": len(self.items),
+            "max_depth": self.max_depth,
+            "received": self.received,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "blocked": self.blocked,
+        }
@@ -1,9 +1,18 @@
+from itertools import count
 from typing import Any, Literal, Union
 from pydantic import BaseModel, Field
 from secrets import token_urlsafe
 
+# Short per-process prefix followed by a sequence number, unique across workers & restarts
+_ID_PREFIX = token_urlsafe(3)
+_ID_SEQUENCE = count(1)
+
+
+def next_event_id() -> str:
+    return f"{_ID_PREFIX}{next(_ID_SEQUENCE):x}"
+
 
 class Event(BaseModel):
-    id: str = Field(default_factory=lambda: token_urlsafe(32))
+    id: str = Field(default_factory=next_event_id)
     code: str
     data: dict[str, Any] = Field(default_factory=dict)
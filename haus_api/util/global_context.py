@@ -4,14 +4,48 @@ from beanie import init_beanie
 from .plugin_loader import PluginLoader, MetaPlugin
 from litestar.channels import ChannelsPlugin
 from .events import *
+from .runtime_config import RuntimeConfig
+from .session_cache import SessionCache
+from .session_renewal import SessionRenewer
+from .session_tokens import SessionTokenSigner, REVOCATION_CHANNEL
+from .session_middleware import RequestAuthStats
+from .access import AccessTable
+from .credentials import CredentialWorker
+from .subscribers import SubscriberRegistry, SUBSCRIBER_CHANNEL
+from .event_encoding import EventEncodings
+from .event_log import EventLog, Published
+from asyncio import Task, create_task
+import json
 
 
 class GlobalContext:
     def __init__(self, channels: ChannelsPlugin):
         self.config = Config.from_config("config.yaml")
+        self.runtime = RuntimeConfig.from_config("config.yaml")
+        self.sessions = SessionCache(self.runtime.session_cache)
+        self.renewals = SessionRenewer(
+            self.runtime.session_renewal,
+            self.config.server.security.sessions.expiration,
+        )
+        self.auth_stats = RequestAuthStats()
+        self.credentials = CredentialWorker(self.runtime.credentials)
+        self.access = AccessTable(
+            self.config.server.security.access_levels,
+            cache_size=self.runtime.access.cache_size,
+        )
+        self.tokens = SessionTokenSigner(
+            self.runtime.session_tokens,
+            self.config.server.security.sessions.expiration,
+        )
         self.motor = AsyncIOMotorClient(self.config.server.database.uri)
         self.plugins = PluginLoader(self.config, self)
         self.channels = channels
+        self.subscribers = SubscriberRegistry()
+        self.subscriber_sync: Optional[Task] = None
+        self.revocation_sync: Optional[Task] = None
+        self.encodings = EventEncodings(self.runtime.events)
+        self.event_log = EventLog(self.runtime.events, channels, self.subscribers)
+        self.subscribers.on_revoke = self.event_log.revoke
         self.scopes = APPLICATION_SCOPES.model_copy(deep=True)
 
     async def initialize(self):
@@ -24,20 +58,93 @@ class GlobalContext:
         conf = self.config.server.security.users.default
         existing_default = await User.find_one(User.username == conf.username)
         if not existing_default and conf.create_if_not_present:
-            new_root = User.create(conf.username, conf.password)
+            new_root = await self.credentials.create_user(conf.username, conf.password)
             new_root.scopes.append("root")
             await new_root.save()
 
+        self.renewals.start()
+        self.event_log.start()
+
+        # Share websocket subscribers with other workers
+        if self.runtime.channels.backend != "memory":
+            await self.start_subscriber_sync()
+            await self.start_revocation_sync()
+
         # Load & initialize plugins
         await self.plugins.load_all()
+        if self.runtime.plugin_watch.enabled:
+            self.plugins.watch()
+
+    async def start_subscriber_sync(self):
+        subscriber = await self.channels.subscribe(SUBSCRIBER_CHANNEL)
+        self.subscribers.announce = lambda message: self.channels.publish(
+            message, [SUBSCRIBER_CHANNEL]
+        )
+
+        async def apply_messages():
+            async for message in subscriber.iter_events():
+                self.subscribers.apply(json.loads(message))
+
+        self.subscriber_sync = create_task(apply_messages())
+        self.subscribers.sync()
+
+    async def start_revocation_sync(self):
+        # Logouts & user changes on other workers, their signed tokens & cached sessions are stale
+        subscriber = await self.channels.subscribe(REVOCATION_CHANNEL)
+        self.tokens.announce = lambda message: self.channels.publish(
+            message, [REVOCATION_CHANNEL]
+        )
+
+        async def apply_messages():
+            async for message in subscriber.iter_events():
+                message = json.loads(message)
+                if not self.tokens.apply(message):
+                    continue
+                if message["op"] == "session":
+                    self.sessions.invalidate(message["session"])
+                else:
+                    self.sessions.invalidate_user(message["user"])
+
+        self.revocation_sync = create_task(apply_messages())
+
+    async def close(self):
+        await self.event_log.stop()
+        if self.subscriber_sync:
+            self.subscribers.leave()
+            self.subscribers.announce = None
+            self.subscriber_sync.cancel()
+            self.subscriber_sync = None
+        if self.revocation_sync:
+            self.tokens.announce = None
+            self.revocation_sync.cancel()
+            self.revocation_sync = None
 
     async def post_event(
-        self, code: str, user_ids: Union[list[str], Literal["*"]] = "*", data: dict = {}
+        self,
+        code: str,
+        user_ids: Union[list[str], Literal["*"]] = "*",
+        data: dict = {},
+        local: bool = False,
+        topic: Optional[str] = None,
+    ):
+        # Plugins run in every worker, so their events only go to local sessions
+        channels = self.subscribers.channels(user_ids, topic=topic, local=local)
+        self.publish_event(code, data, channels, topic=topic)
+
+    def publish_event(
+        self,
+        code: str,
+        data: dict,
+        channels: list[str],
+        topic: Optional[str] = None,
+        parts: Optional[list[str]] = None,
     ):
-        if user_ids == "*":
-            sessions = await Session.find(Session.user_id != None).to_list()
-        else:
-            sessions = await Session.find({"user_id": {"$in": user_ids}}).to_list()
+        if len(channels) == 0:
+            return
 
+        # Encoded once, the same bytes are shared by every channel & history entry.
+        # The topics go along so each connection can filter by its own.
         event = Event(code=code, data=data)
-        self.channels.publish(event.model_dump(), [i.id for i in sessions])
+        self.channels.publish(
+            Published.pack(event.model_dump_json().encode(), topic, parts), channels
+        )
@@ -4,20 +4,22 @@ from litestar.handlers.base import BaseRouteHandler
 from litestar.exceptions import *
 from models import Session, User
 from .errors import build_error
+from .session_middleware import load_session, load_user
+from .scopes import scope_index
 
 
 def guard_has_scope(scope: Union[str, list[str]], all_required: bool = False):
     async def guard_scope_inner(
         connection: ASGIConnection, _: BaseRouteHandler
     ) -> None:
-        session = await Session.get(connection.cookies.get("auth-token", "no-token"))
+        session = await load_session(connection)
         if not session:
             raise NotAuthorizedException(**build_error("access.sessionRequired"))
 
         if not session.user_id:
             raise NotAuthorizedException(**build_error("access.loginRequired"))
 
-        user = await User.get(session.user_id)
+        user = await load_user(connection)
         if not user:
             raise NotAuthorizedException(**build_error("access.loginRequired"))
 
@@ -29,10 +31,11 @@ def guard_has_scope(scope: Union[str, list[str]], all_required: bool = False):
         else:
             scopes = scope[:]
 
+        index = scope_index(user)
         if all_required:
-            valid = all([user.has_scope(s) for s in scopes])
+            valid = all([index.has(s) for s in scopes])
         else:
-            valid = any([user.has_scope(s) for s in scopes])
+            valid = any([index.has(s) for s in scopes])
 
         if not valid:
             raise NotAuthorizedException(**build_error("access.insufficientScope"))
@@ -44,14 +47,14 @@ def guard_within_scope(scope: Union[str, list[str]], all_required: bool = False)
     async def guard_scope_inner(
         connection: ASGIConnection, _: BaseRouteHandler
     ) -> None:
-        session = await Session.get(connection.cookies.get("auth-token", "no-token"))
+        session = await load_session(connection)
         if not session:
             raise NotAuthorizedException(**build_error("access.sessionRequired"))
 
         if not session.user_id:
             raise NotAuthorizedException(**build_error("access.loginRequired"))
 
-        user = await User.get(session.user_id)
+        user = await load_user(connection)
         if not user:
             raise NotAuthorizedException(**build_error("access.loginRequired"))
 
@@ -63,10 +66,11 @@ def guard_within_scope(scope: Union[str, list[str]], all_required: bool = False)
         else:
             scopes = scope[:]
 
+        index = scope_index(user)
         if all_required:
-            valid = all([user.within_scope(s) for s in scopes])
+            valid = all([index.within(s) for s in scopes])
         else:
-            valid = any([user.within_scope(s) for s in scopes])
+            valid = any([index.within(s) for s in scopes])
 
         if not valid:
             raise NotAuthorizedException(**build_error("access.insufficientScope"))
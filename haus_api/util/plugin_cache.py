@@ -0,0 +1,111 @@
+import importlib.util
+import io
+import os
+import sys
+from hashlib import sha256
+from types import ModuleType
+from typing import Optional
+import yaml
+from haus_utils import PluginConfig
+
+MANIFEST_NAMES = ("plugin.yaml", "plugin.yml")
+
+
+def folder_fingerprint(path: str) -> tuple[tuple[str, int, int], ...]:
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".pyc"):
+                continue
+            full = os.path.join(root, name)
+            stat = os.stat(full)
+            entries.append((os.path.relpath(full, path), stat.st_size, stat.st_mtime_ns))
+    return tuple(entries)
+
+
+class PluginCache:
+    """Parsed manifests & executed plugin modules, keyed on a content hash of the plugin folder."""
+
+    def __init__(self) -> None:
+        self.hashes: dict[str, tuple[tuple, str]] = {}
+        self.manifests: dict[str, tuple[str, PluginConfig]] = {}
+        self.options: dict[str, dict] = {}
+        self.modules: dict[str, tuple[str, ModuleType]] = {}
+        self.manifest_hits = 0
+        self.manifest_misses = 0
+        self.module_hits = 0
+        self.module_misses = 0
+
+    def folder_hash(self, path: str) -> str:
+        # File contents are only re-read when a size or mtime changed
+        fingerprint = folder_fingerprint(path)
+        cached = self.hashes.get(path)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        digest = sha256()
+        for name, _, _ in fingerprint:
+            digest.update(name.encode() + b"\0")
+            with open(os.path.join(path, name), "rb") as f:
+                digest.update(f.read())
+            digest.update(b"\0")
+        self.hashes[path] = (fingerprint, digest.hexdigest())
+        return self.hashes[path][1]
+
+    def manifest(self, path: str) -> Optional[PluginConfig]:
+        """The folder's parsed manifest, None if it has none. Raises if it is invalid."""
+        manifest_path = next(
+            (
+                os.path.join(path, name)
+                for name in MANIFEST_NAMES
+                if os.path.exists(os.path.join(path, name))
+            ),
+            None,
+        )
+        if not manifest_path:
+            return None
+
+        digest = self.folder_hash(path)
+        cached = self.manifests.get(path)
+        if cached and cached[0] == digest:
+            self.manifest_hits += 1
+            return cached[1]
+
+        self.manifest_misses += 1
+        with open(manifest_path, "r") as plugin_yaml:
+            raw = plugin_yaml.read()
+        conf = PluginConfig.from_manifest(io.StringIO(raw))
+        self.manifests[path] = (digest, conf)
+        # Keys haus_utils doesn't model, like `concurrency`
+        self.options[path] = yaml.safe_load(raw) or {}
+        return conf
+
+    def manifest_options(self, path: str) -> dict:
+        cached = self.manifests.get(path)
+        if not cached or cached[0] != self.folder_hash(path):
+            self.manifest(path)
+        return self.options.get(path, {})
+
+    def module(self, name: str, path: str, digest: str) -> ModuleType:
+        cached = self.modules.get(name)
+        if cached and cached[0] == digest and sys.modules.get(name) is cached[1]:
+            self.module_hits += 1
+            return cached[1]
+
+        self.module_misses += 1
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        self.modules[name] = (digest, module)
+        return module
+
+    def stats(self) -> dict:
+        return {
+            "folders": len(self.hashes),
+            "manifest_hits": self.manifest_hits,
+            "manifest_misses": self.manifest_misses,
+            "module_hits": self.module_hits,
+            "module_misses": self.module_misses,
+        }
@@ -0,0 +1,122 @@
+import importlib
+import json
+import os
+import sys
+from asyncio import Lock, create_subprocess_exec
+from asyncio.subprocess import PIPE
+from hashlib import sha256
+from importlib.metadata import PackageNotFoundError, version
+from time import perf_counter
+from typing import Any, Iterable, Optional
+from haus_utils import PluginConfig
+from .runtime_config import PluginDependencyConfig
+
+
+class DependencyInstallError(RuntimeError):
+    pass
+
+
+def requirement(dep: Any) -> str:
+    extras = f"[{','.join(dep.extras)}]" if dep.extras else ""
+    pin = f"=={dep.version}" if dep.version else ""
+    return f"{dep.name}{extras}{pin}"
+
+
+def installed_version(name: str) -> Optional[str]:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+class DependencyInstaller:
+    """Installs plugin `pypi` dependencies with pip, from a local wheelhouse when possible."""
+
+    def __init__(self, config: PluginDependencyConfig) -> None:
+        self.config = config
+        self.lock = Lock()
+        self.runs = 0
+        self.installs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.pip_ms = 0.0
+        self.last_error = ""
+
+    def requirements(self, conf: PluginConfig) -> list[Any]:
+        return [d for d in conf.run.dependencies.values() if d.mode == "pypi"]
+
+    def resolved_key(self, conf: PluginConfig) -> Optional[str]:
+        """Hash of the requested & installed versions, None while anything is missing."""
+        resolved = []
+        for dep in self.requirements(conf):
+            installed = installed_version(dep.name)
+            if not installed:
+                return None
+            resolved.append((requirement(dep), installed))
+
+        return sha256(json.dumps(sorted(resolved)).encode()).hexdigest()
+
+    def satisfied(self, conf: PluginConfig, check: Optional[str]) -> bool:
+        key = self.resolved_key(conf)
+        if key is not None and key == check:
+            self.skipped += 1
+            return True
+        return False
+
+    async def pip(self, *args: str) -> bool:
+        self.runs += 1
+        started = perf_counter()
+        process = await create_subprocess_exec(
+            sys.executable, "-m", "pip", *args, stdout=PIPE, stderr=PIPE
+        )
+        _, stderr = await process.communicate()
+        self.pip_ms += (perf_counter() - started) * 1000
+        if process.returncode != 0:
+            self.last_error = stderr.decode()[-2000:]
+        return process.returncode == 0
+
+    async def install(self, deps: Iterable[Any]) -> None:
+        requirements = sorted({requirement(d) for d in deps})
+        if len(requirements) == 0:
+            return
+
+        # pip must not run concurrently against the same environment
+        async with self.lock:
+            if not await self.run_install(requirements):
+                self.failures += 1
+                raise DependencyInstallError(
+                    f"Failed to install {', '.join(requirements)}:\n{self.last_error}"
+                )
+
+            self.installs += 1
+            importlib.invalidate_caches()
+
+    async def run_install(self, requirements: list[str]) -> bool:
+        wheelhouse = self.config.wheelhouse
+        if not wheelhouse:
+            return await self.pip("install", *requirements)
+
+        os.makedirs(wheelhouse, exist_ok=True)
+        local = ["install", "--no-index", "--find-links", wheelhouse, *requirements]
+        if await self.pip(*local):
+            return True
+        if self.config.offline:
+            return False
+
+        # Fetch the missing wheels once, later installs are served locally
+        if not await self.pip(
+            "wheel", "--wheel-dir", wheelhouse, "--find-links", wheelhouse, *requirements
+        ):
+            return False
+        return await self.pip(*local)
+
+    def stats(self) -> dict:
+        return {
+            "wheelhouse": self.config.wheelhouse,
+            "offline": self.config.offline,
+            "pip_runs": self.runs,
+            "installs": self.installs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "pip_ms": self.pip_ms,
+        }
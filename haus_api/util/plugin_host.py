@@ -0,0 +1,481 @@
+"""Runs plugins in worker processes, proxying the Plugin interface over a socket pair.
+
+The API starts one process per plugin group, running `main()` with the socket's fd.
+Messages are msgpack maps framed with a 4 byte length:
+
+- requests `{"id", "plugin", "op", ...}` with op `load`, `initialize`, `get_entities`,
+  `get_actions`, `call_action`, `listen` or `close`
+- replies `{"id", "result"}` or `{"id", "error"}`
+- events `{"event": plugin, "data": ...}`, then `{"event_end": plugin}` once the
+  plugin's `listen_events()` generator finishes
+"""
+
+import logging
+import os
+import socket
+import struct
+import sys
+import traceback
+from asyncio import (
+    Future,
+    IncompleteReadError,
+    Lock,
+    Queue,
+    StreamReader,
+    StreamWriter,
+    Task,
+    create_subprocess_exec,
+    create_task,
+    get_running_loop,
+    open_connection,
+    run,
+    sleep,
+    timeout,
+    wait_for,
+)
+from logging import getLogger
+from time import monotonic
+from typing import Any, AsyncGenerator, Optional
+import msgspec
+from haus_utils import EntityAction, Plugin, PluginConfig, PluginEntity
+from .runtime_config import PluginHostConfig
+
+LENGTH = struct.Struct("!I")
+# Events buffered per plugin before the API stops reading from its worker
+EVENT_BUFFER_SIZE = 64
+# Not `-m util.plugin_host`, the util package itself imports this module
+WORKER_COMMAND = "from util.plugin_host import main; main()"
+HAUS_API_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PluginHostError(RuntimeError):
+    pass
+
+
+async def read_message(reader: StreamReader) -> dict:
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return msgspec.msgpack.decode(await reader.readexactly(length))
+
+
+def write_message(writer: StreamWriter, message: dict) -> None:
+    data = msgspec.msgpack.encode(message)
+    writer.write(LENGTH.pack(len(data)) + data)
+
+
+class PluginProcess:
+    """One supervised worker process, hosting the plugins of one group."""
+
+    def __init__(
+        self, group: str, config: PluginHostConfig, init_timeout: float = 0.0
+    ) -> None:
+        self.group = group
+        self.config = config
+        self.init_timeout = init_timeout
+        self.logger = getLogger("uvicorn.error")
+        self.plugins: dict[str, "RemotePlugin"] = {}
+        self.events: dict[str, Queue] = {}
+        self.pending: dict[int, Future] = {}
+        self.next_id = 0
+        self.process = None
+        self.writer: Optional[StreamWriter] = None
+        self.reader_task: Optional[Task] = None
+        self.restarter: Optional[Task] = None
+        self.starting = Lock()
+        self.started_at = 0.0
+        self.stopping = False
+        self.restarts = 0
+        self.crashes = 0
+        self.calls = 0
+        self.timeouts = 0
+        # Consecutive call timeouts, the worker is restarted once it reaches max_timeouts
+        self.hung_calls = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def spawn(self) -> None:
+        parent, child = socket.socketpair()
+        try:
+            self.process = await create_subprocess_exec(
+                sys.executable,
+                "-c",
+                WORKER_COMMAND,
+                str(child.fileno()),
+                pass_fds=(child.fileno(),),
+                cwd=HAUS_API_ROOT,
+            )
+        finally:
+            child.close()
+
+        reader, self.writer = await open_connection(sock=parent)
+        self.started_at = monotonic()
+        self.stopping = False
+        self.hung_calls = 0
+        self.reader_task = create_task(self.read_loop(reader))
+        self.logger.info(f"Started plugin host {self.group} (pid {self.process.pid}).")
+
+    async def ensure_started(self) -> None:
+        # Plugins of one group load concurrently but must share a single process
+        async with self.starting:
+            if self.restarter and not self.restarter.done():
+                await self.restarter
+            if not self.alive:
+                await self.spawn()
+
+    async def read_loop(self, reader: StreamReader) -> None:
+        try:
+            while True:
+                message = await read_message(reader)
+                if "event" in message:
+                    queue = self.events.get(message["event"])
+                    if queue:
+                        # A full queue stops reading, so the worker's writes block
+                        # and the plugin's listen_events() waits (backpressure)
+                        await queue.put(message["data"])
+                elif "event_end" in message:
+                    queue = self.events.get(message["event_end"])
+                    if queue:
+                        await queue.put(None)
+                else:
+                    future = self.pending.pop(message["id"], None)
+                    if not future or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(PluginHostError(message["error"]))
+                    else:
+                        future.set_result(message.get("result"))
+        except (IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.exited()
+
+    def exited(self) -> None:
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(
+                    PluginHostError(f"Plugin host {self.group} exited.")
+                )
+        self.pending = {}
+        if self.stopping or len(self.plugins) == 0:
+            return
+
+        self.crashes += 1
+        self.logger.error(f"Plugin host {self.group} exited unexpectedly.")
+        self.restarter = create_task(self.restart())
+
+    async def restart(self) -> None:
+        # Back off while the process keeps crashing right after starting
+        if monotonic() - self.started_at > self.config.max_restart_delay:
+            self.restarts = 0
+        while True:
+            delay = min(
+                self.config.restart_delay * (2**self.restarts),
+                self.config.max_restart_delay,
+            )
+            self.restarts += 1
+            await sleep(delay)
+            if self.process and self.process.returncode is None:
+                self.process.kill()
+            try:
+                await self.spawn()
+                break
+            except:
+                self.logger.exception(f"Failed to start plugin host {self.group}:")
+
+        for plugin in list(self.plugins.values()):
+            try:
+                async with timeout(self.init_timeout or None):
+                    await plugin.restore()
+            except:
+                self.logger.exception(
+                    f"Failed to restore plugin {plugin.config.metadata.name}:"
+                )
+
+    async def call(self, plugin: str, op: str, timed: bool = True, **args) -> Any:
+        if not self.alive or not self.writer:
+            raise PluginHostError(f"Plugin host {self.group} is not running.")
+
+        self.next_id += 1
+        self.calls += 1
+        request_id = self.next_id
+        future = get_running_loop().create_future()
+        self.pending[request_id] = future
+        write_message(
+            self.writer, {"id": request_id, "plugin": plugin, "op": op, **args}
+        )
+        try:
+            result = await wait_for(
+                future, (self.config.call_timeout if timed else 0) or None
+            )
+            self.hung_calls = 0
+            return result
+        except TimeoutError:
+            self.timeouts += 1
+            self.hung_calls += 1
+            if self.config.max_timeouts and self.hung_calls >= self.config.max_timeouts:
+                # Alive but stuck, killing it makes the read loop restart it
+                self.logger.error(
+                    f"Plugin host {self.group} timed out {self.hung_calls} calls in a row, restarting it."
+                )
+                self.hung_calls = 0
+                if self.alive:
+                    self.process.kill()
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+
+    def stop_events(self, plugin: str) -> None:
+        # Frees the read loop if it is waiting for room in the plugin's queue
+        queue = self.events.pop(plugin, None)
+        while queue and not queue.empty():
+            queue.get_nowait()
+
+    def release(self, plugin: str) -> None:
+        self.plugins.pop(plugin, None)
+        self.stop_events(plugin)
+
+    async def stop(self) -> None:
+        self.stopping = True
+        if self.restarter:
+            self.restarter.cancel()
+        if self.writer:
+            self.writer.close()
+        if self.process and self.process.returncode is None:
+            try:
+                await wait_for(self.process.wait(), 5)
+            except TimeoutError:
+                self.process.kill()
+        if self.reader_task:
+            self.reader_task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "pid": self.process.pid if self.alive else None,
+            "plugins": sorted(self.plugins.keys()),
+            "calls": self.calls,
+            "pending": len(self.pending),
+            "crashes": self.crashes,
+            "timeouts": self.timeouts,
+            "uptime": monotonic() - self.started_at if self.alive else 0.0,
+        }
+
+
+class RemotePlugin(Plugin):
+    """Proxy for a plugin running in a PluginProcess."""
+
+    def __init__(
+        self,
+        host: PluginProcess,
+        config: PluginConfig,
+        folder: str,
+        settings: dict = {},
+    ) -> None:
+        super().__init__(config, settings=settings)
+        self.host = host
+        self.folder = folder
+        self.listening = False
+        self.name = config.metadata.name
+
+    async def load(self) -> None:
+        self.host.plugins[self.name] = self
+        await self.host.ensure_started()
+        await self.load_remote()
+
+    async def load_remote(self) -> None:
+        await self.host.call(
+            self.name,
+            "load",
+            manifest=self.config.model_dump(mode="json"),
+            folder=self.folder,
+            settings=self.settings,
+        )
+
+    async def initialize(self) -> None:
+        # Bounded by plugin_loading.init_timeout instead of call_timeout
+        await self.host.call(self.name, "initialize", timed=False)
+
+    async def restore(self) -> None:
+        await self.load_remote()
+        await self.initialize()
+        if self.listening:
+            await self.host.call(self.name, "listen")
+
+    async def get_entities(self, ids: Optional[list[str]] = None) -> list[PluginEntity]:
+        result = await self.host.call(self.name, "get_entities", ids=ids)
+        return [PluginEntity.model_validate(e) for e in result]
+
+    async def get_actions(self, ids: Optional[list[str]] = None) -> list[EntityAction]:
+        result = await self.host.call(self.name, "get_actions", ids=ids)
+        return [EntityAction.model_validate(a) for a in result]
+
+    async def call_action(self, action: str, target: Any, fields: Any) -> Any:
+        return await self.host.call(
+            self.name, "call_action", action=action, target=target, fields=fields
+        )
+
+    async def listen_events(self) -> AsyncGenerator[dict, None]:
+        queue = self.host.events[self.name] = Queue(EVENT_BUFFER_SIZE)
+        self.listening = True
+        await self.host.call(self.name, "listen")
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.listening = False
+            if self.host.events.get(self.name) is queue:
+                self.host.stop_events(self.name)
+
+    async def close(self) -> None:
+        try:
+            if self.host.alive:
+                await self.host.call(self.name, "close")
+        finally:
+            self.host.release(self.name)
+
+
+class PluginHosts:
+    """Assigns plugins to worker processes, by group or one process per plugin."""
+
+    def __init__(self, config: PluginHostConfig, init_timeout: float = 0.0) -> None:
+        self.config = config
+        self.init_timeout = init_timeout
+        self.processes: dict[str, PluginProcess] = {}
+
+    def group(self, plugin: str) -> str:
+        for group, plugins in self.config.groups.items():
+            if plugin in plugins:
+                return group
+        return plugin
+
+    def create(self, conf: PluginConfig, folder: str, settings: dict) -> RemotePlugin:
+        group = self.group(conf.metadata.name)
+        if group not in self.processes:
+            self.processes[group] = PluginProcess(group, self.config, self.init_timeout)
+        return RemotePlugin(self.processes[group], conf, folder, settings=settings)
+
+    async def stop(self) -> None:
+        for process in self.processes.values():
+            await process.stop()
+        self.processes = {}
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.config.mode,
+            "processes": {g: p.stats() for g, p in self.processes.items()},
+        }
+
+
+class PluginHostServer:
+    """Worker process side, executes requests against the plugins loaded in it."""
+
+    def __init__(self, writer: StreamWriter) -> None:
+        from .plugin_cache import PluginCache
+
+        self.writer = writer
+        self.cache = PluginCache()
+        self.plugins: dict[str, Plugin] = {}
+        self.listeners: dict[str, Task] = {}
+
+    async def handle(self, message: dict) -> None:
+        try:
+            result = await getattr(self, f"op_{message['op']}")(
+                self.plugins.get(message["plugin"]), message
+            )
+            write_message(self.writer, {"id": message["id"], "result": result})
+        except:
+            write_message(
+                self.writer, {"id": message["id"], "error": traceback.format_exc()}
+            )
+
+    async def op_load(self, _, message: dict) -> None:
+        conf = PluginConfig.model_validate(message["manifest"])
+        module = self.cache.module(
+            f"{conf.metadata.name}.{conf.run.module}",
+            os.path.join(message["folder"], conf.run.module, "__init__.py"),
+            self.cache.folder_hash(message["folder"]),
+        )
+        entrypoint: type[Plugin] = getattr(module, conf.run.entrypoint)
+        self.plugins[conf.metadata.name] = entrypoint(
+            conf, settings=message["settings"]
+        )
+
+    async def op_initialize(self, plugin: Plugin, _) -> None:
+        await plugin.initialize()
+
+    async def op_get_entities(self, plugin: Plugin, message: dict) -> list:
+        return [
+            e.model_dump(mode="json")
+            for e in await plugin.get_entities(ids=message.get("ids"))
+        ]
+
+    async def op_get_actions(self, plugin: Plugin, message: dict) -> list:
+        return [
+            a.model_dump(mode="json")
+            for a in await plugin.get_actions(ids=message.get("ids"))
+        ]
+
+    async def op_call_action(self, plugin: Plugin, message: dict) -> Any:
+        result = await plugin.call_action(
+            message["action"], message["target"], message["fields"]
+        )
+        return (
+            result.model_dump(mode="json") if hasattr(result, "model_dump") else result
+        )
+
+    async def op_listen(self, plugin: Plugin, message: dict) -> None:
+        name = message["plugin"]
+        if name in self.listeners:
+            self.listeners[name].cancel()
+        self.listeners[name] = create_task(self.forward_events(name, plugin))
+
+    async def forward_events(self, name: str, plugin: Plugin) -> None:
+        try:
+            async for event in plugin.listen_events():
+                if event:
+                    write_message(
+                        self.writer,
+                        {"event": name, "data": event.model_dump(mode="json")},
+                    )
+                    await self.writer.drain()
+        except Exception:
+            # Not CancelledError, op_close & re-listening cancel the listener
+            logging.exception(f"Event listener of plugin {name} failed:")
+        write_message(self.writer, {"event_end": name})
+
+    async def op_close(self, plugin: Plugin, message: dict) -> None:
+        name = message["plugin"]
+        if name in self.listeners:
+            self.listeners.pop(name).cancel()
+        self.plugins.pop(name, None)
+        if plugin:
+            await plugin.close()
+
+
+async def serve(fd: int) -> None:
+    reader, writer = await open_connection(sock=socket.socket(fileno=fd))
+    server = PluginHostServer(writer)
+    tasks: set[Task] = set()
+    try:
+        while True:
+            task = create_task(server.handle(await read_message(reader)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (IncompleteReadError, ConnectionError):
+        # The API closed the connection or exited
+        pass
+    finally:
+        for plugin in list(server.plugins.values()):
+            try:
+                async with timeout(5):
+                    await plugin.close()
+            except Exception:
+                pass
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    run(serve(int(sys.argv[1])))
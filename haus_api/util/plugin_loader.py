@@ -1,16 +1,20 @@
 import json
-import subprocess
-import sys
 from traceback import print_exc
-from typing import Optional, Union
+from typing import AsyncContextManager, Optional, Union
 from models import BaseDocument
 from haus_utils import Plugin, Config, PluginConfig, PluginMetadata
 import os
 from pydantic import BaseModel
-import importlib.util
 from logging import getLogger
-from hashlib import sha256
-from asyncio import Lock, Task, create_task
+from time import perf_counter
+from asyncio import Semaphore, Task, create_task, gather, timeout
+from .event_batcher import PluginEventBatcher
+from .event_queue import PluginEventQueue
+from .plugin_dependencies import DependencyInstaller, DependencyInstallError
+from .plugin_cache import PluginCache
+from .plugin_watcher import PluginWatcher
+from .plugin_host import PluginHosts, RemotePlugin
+from .plugin_locks import PluginCallLock, PluginCallPolicy
 
 
 class RedactedMetaPlugin(BaseModel):
@@ -64,27 +68,105 @@ class PluginLoader:
         self.config = config
         self.plugins: dict[str, Plugin] = {}
         self.logger = getLogger("uvicorn.error")
-        self.locks: dict[str, Lock] = {}
+        self.locks: dict[str, PluginCallLock] = {}
         self.listeners: dict[str, Task] = {}
+        self.batchers: dict[str, PluginEventBatcher] = {}
+        self.queues: dict[str, PluginEventQueue] = {}
         self.context = context
+        self.installer = DependencyInstaller(context.runtime.plugin_dependencies)
+        self.cache = PluginCache()
+        self.watcher: Optional[PluginWatcher] = None
+        # Plugin folder -> (plugin id, content hash it was imported from)
+        self.folders: dict[str, tuple[str, str]] = {}
+        self.watch_reloads = 0
+        self.timings: dict[str, dict[str, float]] = {}
+        self.load_time: Optional[float] = None
+        self.batch_install_time: Optional[float] = None
+        self.hosts: Optional[PluginHosts] = None
+        if context.runtime.plugin_hosts.mode == "process":
+            self.hosts = PluginHosts(
+                context.runtime.plugin_hosts,
+                context.runtime.plugin_loading.init_timeout,
+            )
 
-    async def lock(self, plugin: str) -> None:
+    def call_lock(self, plugin: str) -> PluginCallLock:
         if not plugin in self.locks.keys():
-            self.locks[plugin] = Lock()
+            self.locks[plugin] = PluginCallLock(
+                self.context.runtime.plugin_calls.default_mode
+            )
 
-        await self.locks[plugin].acquire()
+        return self.locks[plugin]
+
+    async def lock(self, plugin: str) -> None:
+        # Loading & closing always waits for running calls to finish
+        started = perf_counter()
+        await self.call_lock(plugin).lock.acquire(True)
+        self.call_lock(plugin).record_wait("load", started)
 
     def unlock(self, plugin: str) -> None:
-        if not plugin in self.locks.keys():
-            self.locks[plugin] = Lock()
+        if self.call_lock(plugin).lock.writer:
+            self.call_lock(plugin).lock.release(True)
 
-        if self.locks[plugin].locked():
-            self.locks[plugin].release()
+    def access(self, plugin: str, operation: str) -> AsyncContextManager[None]:
+        """Holds the plugin's lock for one call, as reader or writer depending on its policy."""
+        return self.call_lock(plugin).hold(operation)
+
+    def call_policy(self, folder: str) -> PluginCallPolicy:
+        path = os.path.join(self.config.plugins.folder, folder)
+        try:
+            options = self.cache.manifest_options(path)
+            return PluginCallPolicy.model_validate(options.get("concurrency") or {})
+        except:
+            self.logger.warning(
+                f"Invalid concurrency policy in {folder}, using the default."
+            )
+            return PluginCallPolicy()
+
+    async def close_current(self, plugin: str) -> None:
+        # Only called while holding the plugin's lock exclusively
+        current = self.plugins.get(plugin)
+        if current:
+            self.plugins[plugin] = None
+            try:
+                await current.close()
+            except:
+                self.logger.exception("Close error:")
+
+    async def close_remote(self, plugin: RemotePlugin) -> None:
+        try:
+            await plugin.close()
+        except:
+            self.logger.exception("Close error:")
+
+    async def stop_hosts(self) -> None:
+        if self.hosts:
+            await self.hosts.stop()
+
+    def record_phase(self, plugin: str, phase: str, started: float) -> None:
+        self.timings.setdefault(plugin, {})[phase] = (perf_counter() - started) * 1000
 
     async def load_plugin(
         self, conf: PluginConfig, folder: str
     ) -> tuple[MetaPlugin, Union[Plugin, None]]:
         await self.lock(conf.metadata.name)
+        try:
+            meta, plug = await self.load_locked(conf, folder)
+        finally:
+            self.unlock(conf.metadata.name)
+
+        if plug:
+            await self.setup_listener(plug)
+        return meta, plug
+
+    async def load_locked(
+        self, conf: PluginConfig, folder: str
+    ) -> tuple[MetaPlugin, Union[Plugin, None]]:
+        # Holding the plugin's lock, close whichever instance is current now
+        await self.close_current(conf.metadata.name)
+        self.call_lock(conf.metadata.name).configure(
+            self.call_policy(folder), self.context.runtime.plugin_calls.default_mode
+        )
+        started = perf_counter()
         meta = await MetaPlugin.get(conf.metadata.name)
         if not meta:
             meta = MetaPlugin.create(True, conf, folder)
@@ -103,76 +185,92 @@ class PluginLoader:
             meta.active = False
             meta.status = f"Required field(s) are empty: {', '.join(invalid)}"
             await meta.save()
-            self.unlock(conf.metadata.name)
             return meta, None
 
-        if meta.dependency_check != sha256(
-                conf.run.model_dump_json().encode()).hexdigest():
+        if not self.installer.satisfied(conf, meta.dependency_check):
             try:
-                pypi_dep_strings = []
-
-                for dep in conf.run.dependencies.values():
-                    if dep.mode == "pypi":
-                        pypi_dep_strings.append(
-                            f"{dep.name}{('[' + ','.join(dep.extras) + ']') if dep.extras else ''}{
-                                ('==' + dep.version if dep.version else '')}"
-                        )
-
-                subprocess.call(
-                    [sys.executable, "-m", "pip", "install", *pypi_dep_strings],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
-                meta.dependency_check = sha256(
-                    conf.run.model_dump_json().encode()).hexdigest()
+                await self.installer.install(self.installer.requirements(conf))
+                meta.dependency_check = self.installer.resolved_key(conf)
+                if not meta.dependency_check:
+                    raise DependencyInstallError(
+                        "Dependencies are still missing after installing."
+                    )
             except:
                 self.logger.exception("Dependency error:")
                 meta.active = False
                 meta.status = "Failed to install plugin dependencies."
                 await meta.save()
-                self.unlock(conf.metadata.name)
                 return meta, None
 
         else:
             self.logger.info("Skipping dependency install for " +
                              meta.manifest.metadata.name + ", deps are up-to-date.")
+        self.record_phase(conf.metadata.name, "deps", started)
 
+        started = perf_counter()
+        plug = None
         try:
-            spec = importlib.util.spec_from_file_location(
-                f"{conf.metadata.name}.{conf.run.module}",
-                os.path.join(
-                    self.config.plugins.folder, folder, conf.run.module, "__init__.py"
-                ),
-            )
-            pluginModule = importlib.util.module_from_spec(spec)
-            sys.modules[f"{conf.metadata.name}.{conf.run.module}"] = pluginModule
-            spec.loader.exec_module(pluginModule)
-            pluginEntrypoint: type[Plugin] = getattr(pluginModule, conf.run.entrypoint)
+            # Unchanged folders reuse the executed module, only the entrypoint is re-instantiated
+            path = os.path.join(self.config.plugins.folder, folder)
+            digest = self.cache.folder_hash(path)
+            if self.hosts:
+                # The worker process imports & instantiates the plugin
+                plug = self.hosts.create(
+                    conf, os.path.abspath(path), meta.settings
+                )
+                await plug.load()
+            else:
+                pluginModule = self.cache.module(
+                    f"{conf.metadata.name}.{conf.run.module}",
+                    os.path.join(path, conf.run.module, "__init__.py"),
+                    digest,
+                )
+                pluginEntrypoint: type[Plugin] = getattr(
+                    pluginModule, conf.run.entrypoint
+                )
+            self.folders[folder] = (conf.metadata.name, digest)
+            self.record_phase(conf.metadata.name, "import", started)
         except:
             self.logger.exception("Import error:")
+            if plug:
+                await self.close_remote(plug)
             meta.active = False
             meta.status = "Failed to import plugin entrypoint."
             await meta.save()
-            self.unlock(conf.metadata.name)
             return meta, None
 
+        started = perf_counter()
+        deadline = timeout(self.context.runtime.plugin_loading.init_timeout or None)
         try:
-            plug = pluginEntrypoint(conf, settings=meta.settings)
-            await plug.initialize()
+            if not self.hosts:
+                plug = pluginEntrypoint(conf, settings=meta.settings)
+            async with deadline:
+                await plug.initialize()
+            self.record_phase(conf.metadata.name, "init", started)
             meta.status = None
             await meta.save()
             self.logger.info(
                 f"Initialized plugin {meta.id} ({meta.manifest.metadata.display_name})"
             )
-            self.unlock(conf.metadata.name)
-            await self.setup_listener(plug)
+            self.plugins[meta.id] = plug
             return meta, plug
         except:
-            self.logger.exception("Initialization error:")
+            # TimeoutErrors raised by the plugin itself (e.g. network) are init errors
+            if deadline.expired():
+                self.logger.error(f"Initialization of plugin {meta.id} timed out.")
+                self.record_phase(conf.metadata.name, "init", started)
+                try:
+                    await plug.close()
+                except:
+                    self.logger.exception("Close error:")
+                meta.status = "Plugin initialization timed out."
+            else:
+                self.logger.exception("Initialization error:")
+                if self.hosts:
+                    await self.close_remote(plug)
+                meta.status = "Failed to initialize plugin."
             meta.active = False
-            meta.status = "Failed to initialize plugin."
             await meta.save()
-            self.unlock(conf.metadata.name)
             return meta, None
 
     async def load_all(self):
@@ -185,41 +283,141 @@ class PluginLoader:
             await plug.close()
             self.unlock(plug.config.metadata.name)
         self.plugins = {}
+        self.timings = {}
 
-        for f in os.listdir(self.config.plugins.folder):
-            try:
-                if os.path.exists(
-                    os.path.join(self.config.plugins.folder, f, "plugin.yaml")
-                ):
-                    with open(
-                        os.path.join(self.config.plugins.folder, f, "plugin.yaml"), "r"
-                    ) as plugin_yaml:
-                        conf = PluginConfig.from_manifest(plugin_yaml)
-                elif os.path.exists(
-                    os.path.join(self.config.plugins.folder, f, "plugin.yml")
-                ):
-                    with open(
-                        os.path.join(self.config.plugins.folder, f, "plugin.yml"), "r"
-                    ) as plugin_yaml:
-                        conf = PluginConfig.from_manifest(plugin_yaml)
-                else:
-                    self.logger.error(
-                        f"Failed to load plugin from folder {f}, plugin manifest is missing."
-                    )
-                    continue
-            except:
-                self.logger.error(
-                    f"Failed to load plugin from folder {f}, plugin manifest is invalid or malformed YAML."
-                )
-                continue
+        # Plugins load concurrently, limited so slow initializations don't all start at once
+        semaphore = Semaphore(max(self.context.runtime.plugin_loading.concurrency, 1))
+
+        async def load_limited(conf: PluginConfig, folder: str):
+            async with semaphore:
+                return await self.load_plugin(conf, folder)
 
-            meta, plugin = await self.load_plugin(conf, f)
+        started = perf_counter()
+        manifests = [
+            (f, conf)
+            for f in os.listdir(self.config.plugins.folder)
+            if (conf := self.load_manifest(f))
+        ]
+        await self.install_all(manifests)
+        results = await gather(*[load_limited(conf, f) for f, conf in manifests])
+        self.load_time = (perf_counter() - started) * 1000
+
+        for meta, plugin in results:
             if meta.status and not plugin:
                 self.logger.error(f"Failed to load plugin {meta.id}: {meta.status}")
                 self.plugins[meta.id] = None
             else:
                 self.plugins[meta.id] = plugin
 
+    async def install_all(self, manifests: list[tuple[str, PluginConfig]]) -> None:
+        """Installs the missing dependencies of all plugins with a single pip run.
+
+        If that fails (for example conflicting pins), load_plugin retries each plugin
+        on its own, so only the plugins that can't be installed fail.
+        """
+        pending: list[tuple[PluginConfig, MetaPlugin]] = []
+        for folder, conf in manifests:
+            meta = await MetaPlugin.get(conf.metadata.name)
+            if not meta:
+                meta = MetaPlugin.create(True, conf, folder)
+            if not self.installer.satisfied(conf, meta.dependency_check):
+                pending.append((conf, meta))
+
+        deps = [d for conf, _ in pending for d in self.installer.requirements(conf)]
+        if len(deps) == 0:
+            return
+
+        started = perf_counter()
+        try:
+            await self.installer.install(deps)
+        except DependencyInstallError:
+            self.logger.warning(
+                "Batched dependency install failed, installing per plugin."
+            )
+            return
+        finally:
+            self.batch_install_time = (perf_counter() - started) * 1000
+
+        for conf, meta in pending:
+            meta.dependency_check = self.installer.resolved_key(conf)
+            await meta.save()
+
+    def load_manifest(self, f: str) -> Optional[PluginConfig]:
+        started = perf_counter()
+        try:
+            conf = self.cache.manifest(os.path.join(self.config.plugins.folder, f))
+            if not conf:
+                self.logger.error(
+                    f"Failed to load plugin from folder {f}, plugin manifest is missing."
+                )
+                return None
+        except:
+            self.logger.error(
+                f"Failed to load plugin from folder {f}, plugin manifest is invalid or malformed YAML."
+            )
+            return None
+
+        self.record_phase(conf.metadata.name, "manifest", started)
+        return conf
+
+    async def reload_plugin(
+        self, conf: PluginConfig, folder: str
+    ) -> tuple[MetaPlugin, Union[Plugin, None]]:
+        # load_plugin closes the current instance & stores the new one under the plugin's lock
+        meta, plugin = await self.load_plugin(conf, folder)
+        if meta.status and not plugin:
+            self.logger.error(f"Failed to load plugin {meta.id}: {meta.status}")
+        return meta, plugin
+
+    async def reload_folder(self, folder: str) -> None:
+        """Reloads the plugin in `folder` if its contents changed since it was imported."""
+        path = os.path.join(self.config.plugins.folder, folder)
+        loaded = self.folders.get(folder)
+        if not os.path.isdir(path):
+            if loaded and self.plugins.get(loaded[0]):
+                self.logger.info(
+                    f"Plugin folder {folder} was removed, closing {loaded[0]}."
+                )
+                await self.lock(loaded[0])
+                try:
+                    await self.close_current(loaded[0])
+                finally:
+                    self.unlock(loaded[0])
+            self.folders.pop(folder, None)
+            return
+
+        if loaded and loaded[1] == self.cache.folder_hash(path):
+            return
+
+        conf = self.load_manifest(folder)
+        if not conf:
+            return
+
+        self.logger.info(
+            f"Plugin folder {folder} changed, reloading {conf.metadata.name}."
+        )
+        self.watch_reloads += 1
+        meta, _ = await self.reload_plugin(conf, folder)
+        await self.context.post_event(
+            "plugins",
+            data={"target": meta.id, "method": "reload"},
+            topic=f"plugins.{meta.id}",
+        )
+
+    def watch(self) -> None:
+        if not self.watcher and os.path.isdir(self.config.plugins.folder):
+            self.watcher = PluginWatcher(
+                self.config.plugins.folder,
+                self.context.runtime.plugin_watch,
+                self.reload_folder,
+            )
+            self.watcher.start()
+
+    async def unwatch(self) -> None:
+        if self.watcher:
+            await self.watcher.stop()
+            self.watcher = None
+
     async def setup_listener(self, plugin: Plugin):
         if plugin.config.metadata.name in self.listeners.keys():
             self.listeners[plugin.config.metadata.name].cancel()
@@ -229,6 +427,53 @@ class PluginLoader:
         self.listeners[plugin.config.metadata.name] = task
 
     async def listen_to(self, plugin: Plugin):
-        async for event in plugin.listen_events():
-            if event:
-                await self.context.post_event("plugin.event", user_ids="*", data=event.model_dump())
+        name = plugin.config.metadata.name
+        queue = PluginEventQueue(self.context.runtime.plugin_events)
+        batcher = PluginEventBatcher(
+            self.context, name, self.context.runtime.plugin_events
+        )
+        self.queues[name] = queue
+        self.batchers[name] = batcher
+        forwarder = create_task(self.forward_events(queue, batcher))
+        try:
+            async for event in plugin.listen_events():
+                if event:
+                    # Events from worker processes arrive already dumped
+                    await queue.put(
+                        event if isinstance(event, dict) else event.model_dump()
+                    )
+        finally:
+            # The forwarder publishes what is still queued, then stops
+            await queue.close()
+            await forwarder
+            await batcher.close()
+
+    async def forward_events(
+        self, queue: PluginEventQueue, batcher: PluginEventBatcher
+    ):
+        while (item := await queue.get()) is not None:
+            await batcher.add(item)
+
+    def load_stats(self) -> dict:
+        return {
+            "concurrency": self.context.runtime.plugin_loading.concurrency,
+            "total_ms": self.load_time,
+            "batch_install_ms": self.batch_install_time,
+            "dependencies": self.installer.stats(),
+            "cache": self.cache.stats(),
+            "hosts": self.hosts.stats() if self.hosts else {"mode": "inline"},
+            "watch": {
+                **(self.watcher.stats() if self.watcher else {"backend": None}),
+                "reloads": self.watch_reloads,
+            },
+            "plugins": self.timings,
+        }
+
+    def call_stats(self) -> dict:
+        return {name: lock.stats() for name, lock in self.locks.items()}
+
+    def event_stats(self) -> dict:
+        return {
+            name: {**batcher.stats(), "queue": self.queues[name].stats()}
+            for name, batcher in self.batchers.items()
+        }
@@ -0,0 +1,144 @@
+from asyncio import CancelledError, Future, Semaphore, get_running_loop
+from collections import deque
+from contextlib import asynccontextmanager, suppress
+from time import perf_counter
+from typing import AsyncIterator, Literal, Optional
+from pydantic import BaseModel
+
+READ_OPERATIONS = ("get_entities", "get_actions")
+
+
+class PluginCallPolicy(BaseModel):
+    """The `concurrency` section of a plugin manifest."""
+
+    # None uses runtime.plugin_calls.default_mode
+    mode: Optional[Literal["exclusive", "readwrite", "concurrent"]] = None
+    # Operation -> maximum calls running at once, 0 for no limit
+    limits: dict[str, int] = {}
+
+
+class ReadWriteLock:
+    """FIFO reader/writer lock, readers queue behind a waiting writer so writers can't starve."""
+
+    def __init__(self) -> None:
+        self.readers = 0
+        self.writer = False
+        self.waiters: deque[tuple[Future, bool]] = deque()
+
+    def free(self, exclusive: bool) -> bool:
+        return not self.writer and (self.readers == 0 or not exclusive)
+
+    def enter(self, exclusive: bool) -> None:
+        if exclusive:
+            self.writer = True
+        else:
+            self.readers += 1
+
+    async def acquire(self, exclusive: bool) -> None:
+        if len(self.waiters) == 0 and self.free(exclusive):
+            self.enter(exclusive)
+            return
+
+        future = get_running_loop().create_future()
+        self.waiters.append((future, exclusive))
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted right before the cancellation
+                self.release(exclusive)
+            else:
+                # wake() may have dropped the cancelled waiter already
+                with suppress(ValueError):
+                    self.waiters.remove((future, exclusive))
+                self.wake()
+            raise
+
+    def release(self, exclusive: bool) -> None:
+        if exclusive:
+            self.writer = False
+        else:
+            self.readers -= 1
+        self.wake()
+
+    def wake(self) -> None:
+        while len(self.waiters) > 0:
+            future, exclusive = self.waiters[0]
+            if future.done():
+                self.waiters.popleft()
+                continue
+            if not self.free(exclusive):
+                break
+            self.waiters.popleft()
+            self.enter(exclusive)
+            future.set_result(None)
+
+
+class PluginCallLock:
+    """Guards one plugin's calls according to its PluginCallPolicy, and times the waits."""
+
+    def __init__(self, mode: str) -> None:
+        self.lock = ReadWriteLock()
+        self.mode = mode
+        self.semaphores: dict[str, Semaphore] = {}
+        self.running: dict[str, int] = {}
+        self.waits: dict[str, dict] = {}
+
+    def configure(self, policy: PluginCallPolicy, default_mode: str) -> None:
+        # Only called while holding the lock exclusively, so no permits are out
+        self.mode = policy.mode or default_mode
+        self.semaphores = {
+            op: Semaphore(limit) for op, limit in policy.limits.items() if limit > 0
+        }
+
+    def exclusive(self, operation: str) -> bool:
+        if self.mode == "exclusive":
+            return True
+        if self.mode == "readwrite":
+            return operation not in READ_OPERATIONS
+        return False
+
+    def record_wait(self, operation: str, started: float) -> None:
+        wait = (perf_counter() - started) * 1000
+        stats = self.waits.setdefault(
+            operation, {"calls": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0}
+        )
+        stats["calls"] += 1
+        stats["wait_total_ms"] += wait
+        stats["wait_max_ms"] = max(stats["wait_max_ms"], wait)
+
+    @asynccontextmanager
+    async def hold(self, operation: str) -> AsyncIterator[None]:
+        exclusive = self.exclusive(operation)
+        semaphore = self.semaphores.get(operation)
+        started = perf_counter()
+        await self.lock.acquire(exclusive)
+        try:
+            if semaphore:
+                await semaphore.acquire()
+            self.record_wait(operation, started)
+            self.running[operation] = self.running.get(operation, 0) + 1
+            try:
+                yield
+            finally:
+                self.running[operation] -= 1
+                if semaphore:
+                    semaphore.release()
+        finally:
+            self.lock.release(exclusive)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "readers": self.lock.readers,
+            "writer": self.lock.writer,
+            "queued": len(self.lock.waiters),
+            "running": {op: n for op, n in self.running.items() if n > 0},
+            "operations": {
+                op: {
+                    **stats,
+                    "wait_mean_ms": stats["wait_total_ms"] / stats["calls"],
+                }
+                for op, stats in self.waits.items()
+            },
+        }
@@ -0,0 +1,191 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+from asyncio import Task, create_task, get_running_loop, sleep
+from logging import getLogger
+from time import monotonic
+from typing import Awaitable, Callable, Optional
+from .plugin_cache import folder_fingerprint
+from .runtime_config import PluginWatchConfig
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def ignored(name: str) -> bool:
+    return name == "__pycache__" or name.endswith(".pyc")
+
+
+class Inotify:
+    """Recursive inotify watch through libc, Linux only."""
+
+    def __init__(self, root: str, changed: Callable[[str], None]) -> None:
+        self.root = root
+        self.changed = changed
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths: dict[int, str] = {}
+        self.add_tree(root)
+        get_running_loop().add_reader(self.fd, self.read)
+
+    def add_tree(self, path: str) -> None:
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [d for d in dirs if not ignored(d)]
+            wd = self.libc.inotify_add_watch(self.fd, root.encode(), WATCH_MASK)
+            if wd >= 0:
+                self.paths[wd] = root
+
+    def read(self) -> None:
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[
+                offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length
+            ]
+            name = name.rstrip(b"\0").decode(errors="replace")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, let the loader compare every folder
+                for folder in os.listdir(self.root):
+                    self.changed(folder)
+                continue
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+
+            directory = self.paths.get(wd)
+            if directory is None or ignored(name):
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+
+            parts = os.path.relpath(path, self.root).split(os.sep)
+            if parts[0] != "." and not any(ignored(p) for p in parts):
+                self.changed(parts[0])
+
+    def close(self) -> None:
+        get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class PluginWatcher:
+    """Reports changed plugin folders after `debounce` seconds without further changes."""
+
+    def __init__(
+        self,
+        root: str,
+        config: PluginWatchConfig,
+        on_change: Callable[[str], Awaitable[None]],
+    ) -> None:
+        self.root = root
+        self.config = config
+        self.on_change = on_change
+        self.logger = getLogger("uvicorn.error")
+        self.backend: Optional[str] = None
+        self.inotify: Optional[Inotify] = None
+        self.poller: Optional[Task] = None
+        self.flusher: Optional[Task] = None
+        self.pending: set[str] = set()
+        self.last_change = 0.0
+        self.events = 0
+        self.flushes = 0
+
+    def start(self) -> None:
+        if self.config.backend in ("auto", "inotify"):
+            try:
+                self.inotify = Inotify(self.root, self.changed)
+                self.backend = "inotify"
+            except (OSError, AttributeError):
+                # No inotify on this platform or out of watches
+                self.logger.warning("inotify is unavailable, polling plugin folders.")
+
+        if not self.inotify:
+            self.backend = "poll"
+            self.poller = create_task(self.poll())
+        self.logger.info(f"Watching {self.root} for plugin changes ({self.backend}).")
+
+    async def stop(self) -> None:
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        for task in (self.poller, self.flusher):
+            if task:
+                task.cancel()
+        self.poller = self.flusher = None
+
+    def snapshot(self) -> dict[str, tuple]:
+        return {
+            f: folder_fingerprint(os.path.join(self.root, f))
+            for f in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, f))
+        }
+
+    async def poll(self) -> None:
+        previous = self.snapshot()
+        while True:
+            await sleep(self.config.poll_interval)
+            current = self.snapshot()
+            for folder in previous.keys() | current.keys():
+                if previous.get(folder) != current.get(folder):
+                    self.changed(folder)
+            previous = current
+
+    def changed(self, folder: str) -> None:
+        self.events += 1
+        self.pending.add(folder)
+        self.last_change = monotonic()
+        if not self.flusher or self.flusher.done():
+            self.flusher = create_task(self.flush())
+
+    async def flush(self) -> None:
+        while len(self.pending) > 0:
+            while (wait := self.last_change + self.config.debounce - monotonic()) > 0:
+                await sleep(wait)
+
+            folders, self.pending = self.pending, set()
+            self.flushes += 1
+            for folder in sorted(folders):
+                try:
+                    await self.on_change(folder)
+                except:
+                    self.logger.exception(f"Failed to reload plugin folder {folder}:")
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "events": self.events,
+            "flushes": self.flushes,
+            "pending": len(self.pending),
+        }
@@ -0,0 +1,114 @@
+import os
+from typing import Literal, Optional
+import yaml
+from pydantic import BaseModel
+
+
+class SessionCacheConfig(BaseModel):
+    enabled: bool = True
+    max_size: int = 4096
+    ttl: float = 30.0
+
+
+class SessionRenewalConfig(BaseModel):
+    mode: Literal["immediate", "write_behind"] = "immediate"
+    flush_interval: float = 10.0
+    threshold: float = 0.5
+
+
+class SessionTokenConfig(BaseModel):
+    enabled: bool = False
+    secret: Optional[str] = None
+    ttl: float = 300.0
+    refresh_threshold: float = 0.5
+
+
+class AccessConfig(BaseModel):
+    cache_size: int = 4096
+
+
+class CredentialConfig(BaseModel):
+    workers: int = 2
+    max_queue: int = 64
+
+
+class PluginEventConfig(BaseModel):
+    batch_window: float = 0.05
+    batch_size: int = 200
+    queue_size: int = 1000
+    overflow: Literal["block", "drop_oldest", "coalesce"] = "block"
+
+
+class PluginLoadingConfig(BaseModel):
+    concurrency: int = 8
+    init_timeout: float = 60.0
+
+
+class PluginWatchConfig(BaseModel):
+    enabled: bool = False
+    backend: Literal["auto", "inotify", "poll"] = "auto"
+    debounce: float = 0.5
+    poll_interval: float = 1.0
+
+
+class PluginDependencyConfig(BaseModel):
+    wheelhouse: Optional[str] = "plugin_wheels"
+    offline: bool = False
+
+
+class PluginCallConfig(BaseModel):
+    default_mode: Literal["exclusive", "readwrite", "concurrent"] = "exclusive"
+
+
+class PluginHostConfig(BaseModel):
+    mode: Literal["inline", "process"] = "inline"
+    # Group name -> plugin ids sharing one process, others get a process each
+    groups: dict[str, list[str]] = {}
+    call_timeout: float = 30.0
+    # Consecutive timed out calls after which a worker is restarted, 0 never
+    max_timeouts: int = 3
+    restart_delay: float = 1.0
+    max_restart_delay: float = 60.0
+
+
+class ChannelsConfig(BaseModel):
+    backend: Literal["memory", "unix", "redis"] = "memory"
+    socket_path: str = "/tmp/haus-channels.sock"
+    broker_buffer_size: int = 16 * 1024 * 1024
+    redis_url: str = "redis://localhost:6379/0"
+
+
+class EventStreamConfig(BaseModel):
+    encodings: list[Literal["msgpack", "cbor", "json"]] = ["msgpack", "cbor", "json"]
+    replay_size: int = 256
+    replay_age: float = 300.0
+    listener_queue_size: int = 1024
+    heartbeat_interval: float = 30.0
+    # Opt-in, clients must answer heartbeats to stay connected
+    idle_timeout: float = 0.0
+
+
+class RuntimeConfig(BaseModel):
+    session_cache: SessionCacheConfig = SessionCacheConfig()
+    session_renewal: SessionRenewalConfig = SessionRenewalConfig()
+    session_tokens: SessionTokenConfig = SessionTokenConfig()
+    access: AccessConfig = AccessConfig()
+    credentials: CredentialConfig = CredentialConfig()
+    plugin_events: PluginEventConfig = PluginEventConfig()
+    plugin_loading: PluginLoadingConfig = PluginLoadingConfig()
+    plugin_dependencies: PluginDependencyConfig = PluginDependencyConfig()
+    plugin_watch: PluginWatchConfig = PluginWatchConfig()
+    plugin_hosts: PluginHostConfig = PluginHostConfig()
+    plugin_calls: PluginCallConfig = PluginCallConfig()
+    channels: ChannelsConfig = ChannelsConfig()
+    events: EventStreamConfig = EventStreamConfig()
+
+    @classmethod
+    def from_config(cls, path: str) -> "RuntimeConfig":
+        if not os.path.exists(path):
+            return RuntimeConfig()
+
+        with open(path, "r") as config_file:
+            data = yaml.safe_load(config_file) or {}
+
+        return RuntimeConfig(**(data.get("runtime") or {}))
@@ -0,0 +1,67 @@
+from functools import lru_cache
+from models import User
+
+# Marks the end of a granted scope, can't collide with any segment
+_TERMINAL = object()
+
+
+def scope_parts(scope: str) -> list[str]:
+    # Empty segments ("a..b", "app.", "") never name a scope
+    parts = scope.split(".")
+    return [] if "" in parts else parts
+
+
+class ScopeIndex:
+    def __init__(self, scopes: tuple[str, ...]) -> None:
+        self.root = "root" in scopes
+        self.tree: dict = {}
+        for scope in scopes:
+            parts = scope_parts(scope)
+            if len(parts) == 0:
+                continue
+
+            node = self.tree
+            for part in parts:
+                node = node.setdefault(part, {})
+            node[_TERMINAL] = True
+
+    def has(self, scope: str) -> bool:
+        if self.root:
+            return True
+
+        node = self.tree
+        parts = scope_parts(scope)
+        if len(parts) == 0:
+            return False
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+        return False
+
+    def within(self, scope: str) -> bool:
+        if self.root:
+            return True
+
+        node = self.tree
+        parts = scope_parts(scope)
+        if len(parts) == 0:
+            return False
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+        return True
+
+
+@lru_cache(maxsize=1024)
+def compile_scopes(scopes: tuple[str, ...]) -> ScopeIndex:
+    return ScopeIndex(scopes)
+
+
+def scope_index(user: User) -> ScopeIndex:
+    return compile_scopes(tuple(user.scopes))
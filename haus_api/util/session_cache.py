@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Optional
+from models import Session
+from .runtime_config import SessionCacheConfig
+
+
+class SessionCache:
+    def __init__(self, config: SessionCacheConfig) -> None:
+        self.config = config
+        self.entries: OrderedDict[str, tuple[float, Session]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, session_id: str) -> Optional[Session]:
+        entry = self.entries.get(session_id)
+        if not entry:
+            return None
+
+        stored_at, session = entry
+        if monotonic() - stored_at > self.config.ttl:
+            del self.entries[session_id]
+            return None
+
+        self.entries.move_to_end(session_id)
+        return session
+
+    def store(self, session: Session) -> None:
+        if not self.config.enabled:
+            return
+
+        self.entries[session.id] = (monotonic(), session)
+        self.entries.move_to_end(session.id)
+        while len(self.entries) > self.config.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, session_id: str) -> None:
+        self.entries.pop(session_id, None)
+
+    def invalidate_user(self, user_id: str) -> None:
+        for key in [k for k, v in self.entries.items() if v[1].user_id == user_id]:
+            del self.entries[key]
+
+    def cached(self, session_id: str) -> Optional[Session]:
+        cached = self.lookup(session_id)
+        if cached:
+            self.hits += 1
+        return cached
+
+    async def fetch(self, session_id: str) -> Optional[Session]:
+        self.misses += 1
+        result = await Session.get(session_id)
+        if result:
+            self.store(result)
+        return result
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        return self.cached(session_id) or await self.fetch(session_id)
+
+    async def save(self, session: Session) -> None:
+        self.invalidate(session.id)
+        await session.save()
+        self.store(session)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.config.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,11 +1,84 @@
-from models import Session
-from litestar.middleware import AbstractMiddleware
-from litestar.enums import ScopeType
-from litestar.datastructures import MutableScopeHeaders
+from models import Session, User
 from litestar.enums import ScopeType
 from litestar.middleware import AbstractMiddleware
 from litestar.types import Message, Receive, Scope, Send
-from .cookies import Cookie, Cookies
+from litestar.connection import ASGIConnection
+from typing import Optional
+from .auth_cookie import add_auth_cookie, read_auth_cookie, replace_auth_cookie
+
+AUTH_KEY = "haus_auth"
+
+
+class RequestAuth:
+    def __init__(self, session: Session, pending: bool, db_reads: int = 0) -> None:
+        self.session = session
+        self.pending = pending
+        self.user: Optional[User] = None
+        self.db_reads = db_reads
+
+
+class RequestAuthStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.db_reads = 0
+        self.max_db_reads = 0
+        self.histogram: dict[int, int] = {}
+
+    def record(self, auth: RequestAuth) -> None:
+        self.requests += 1
+        self.db_reads += auth.db_reads
+        self.max_db_reads = max(self.max_db_reads, auth.db_reads)
+        self.histogram[auth.db_reads] = self.histogram.get(auth.db_reads, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "db_reads": self.db_reads,
+            "mean_db_reads": self.db_reads / self.requests if self.requests else 0.0,
+            "max_db_reads": self.max_db_reads,
+            "db_reads_per_request": {
+                str(k): v for k, v in sorted(self.histogram.items())
+            },
+        }
+
+
+def request_auth(connection: ASGIConnection) -> Optional[RequestAuth]:
+    auth: Optional[RequestAuth] = connection.scope.get("state", {}).get(AUTH_KEY)
+    if auth and auth.session.id == connection.cookies.get("auth-token"):
+        return auth
+    return None
+
+
+async def load_session(
+    connection: ASGIConnection, persist: bool = False
+) -> Optional[Session]:
+    context = connection.app.state.context
+    auth = request_auth(connection)
+    if not auth:
+        return await context.sessions.get(
+            connection.cookies.get("auth-token", "no-token")
+        )
+
+    # Anonymous sessions are only stored once a handler asks for them
+    if auth.pending and persist:
+        await context.sessions.save(auth.session)
+        auth.pending = False
+    return auth.session
+
+
+async def load_user(connection: ASGIConnection) -> Optional[User]:
+    session = await load_session(connection)
+    if not session or not session.user_id:
+        return None
+
+    auth = request_auth(connection)
+    if not auth:
+        return await User.get(session.user_id)
+
+    if not auth.user or auth.user.id != session.user_id:
+        auth.db_reads += 1
+        auth.user = await User.get(session.user_id)
+    return auth.user
 
 
 class SessionMiddleware(AbstractMiddleware):
@@ -17,57 +90,59 @@ class SessionMiddleware(AbstractMiddleware):
         receive: Receive,
         send: Send,
     ) -> None:
-        headers = MutableScopeHeaders(scope=scope)
-        current_cookies = {}
-        cookie_header = headers.get("cookie")
-        if cookie_header:
-            for cookie in cookie_header.split(";"):
-                stripped = cookie.strip()
-                current_cookies[stripped.split("=")[0]] = stripped.split("=")[1]
-        auth_cookie = current_cookies.get("auth-token")
-        if not auth_cookie:
-            new_session = Session.create(
-                scope["app"].state.context.config.server.security.sessions.expiration
-            )
-            await new_session.save()
-            current_cookies["auth-token"] = new_session.id
-            headers["cookie"] = "; ".join(
-                [f"{k}={v}" for k, v in current_cookies.items()]
-            )
-            cookie_id = new_session.id
-        else:
-            active_session = await Session.get(auth_cookie)
+        auth_cookie = original_cookie = read_auth_cookie(scope)
+        context = scope["app"].state.context
+        active_session = None
+        claims = None
+        db_reads = 0
+        if auth_cookie and context.tokens.enabled:
+            parsed = context.tokens.parse(auth_cookie)
+            if parsed:
+                claims, valid = parsed
+                if context.tokens.trusted(claims, valid):
+                    active_session = context.tokens.session(claims)
+                else:
+                    claims = None
+                auth_cookie = parsed[0].session_id
+
+        if not active_session and auth_cookie:
+            active_session = context.sessions.cached(auth_cookie)
+            if not active_session:
+                db_reads += 1
+                active_session = await context.sessions.fetch(auth_cookie)
             if active_session:
-                cookie_id = auth_cookie
-                await active_session.renew(
-                    scope[
-                        "app"
-                    ].state.context.config.server.security.sessions.expiration
-                )
-            else:
-                new_session = Session.create(
-                    scope[
-                        "app"
-                    ].state.context.config.server.security.sessions.expiration
-                )
-                await new_session.save()
-                current_cookies["auth-token"] = new_session.id
-                headers["cookie"] = "; ".join(
-                    [f"{k}={v}" for k, v in current_cookies.items()]
-                )
-                cookie_id = new_session.id
-
-        def send_wrapper_setup(token: str):
-            async def send_wrapper(message: "Message") -> None:
-                if message["type"] == "http.response.start":
-                    headers = MutableScopeHeaders.from_message(message=message)
-                    response_cookies = Cookies()
-                    response_cookies.add(Cookie("auth-token", token))
-                    headers["set-cookie"] = "; ".join(
-                        response_cookies.render_response()
-                    )
-                await send(message)
-
-            return send_wrapper
-
-        await self.app(scope, receive, send_wrapper_setup(cookie_id))
+                await context.renewals.touch(active_session)
+
+        if active_session:
+            auth = RequestAuth(active_session, False, db_reads)
+        else:
+            auth = RequestAuth(
+                Session.create(context.config.server.security.sessions.expiration),
+                True,
+                db_reads,
+            )
+
+        scope.setdefault("state", {})[AUTH_KEY] = auth
+        if original_cookie != auth.session.id:
+            # Downstream code expects the plain session id
+            replace_auth_cookie(scope, auth.session.id)
+
+        def response_token() -> str:
+            if not context.tokens.enabled:
+                return auth.session.id
+
+            if claims and claims.user_id == auth.session.user_id:
+                return original_cookie
+            return context.tokens.sign(auth.session)
+
+        async def send_wrapper(message: "Message") -> None:
+            if message["type"] == "http.response.start" and not auth.pending:
+                token = response_token()
+                if token != original_cookie:
+                    add_auth_cookie(message, token)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            context.auth_stats.record(auth)
@@ -0,0 +1,95 @@
+from asyncio import CancelledError, Task, create_task, sleep
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import Optional
+from pymongo import UpdateOne
+from models import Session
+from .runtime_config import SessionRenewalConfig
+
+
+class SessionRenewer:
+    def __init__(self, config: SessionRenewalConfig, expiration) -> None:
+        self.config = config
+        self.expiration = expiration
+        self.pending: dict[str, tuple[Session, datetime]] = {}
+        self.task: Optional[Task] = None
+        self.logger = getLogger("uvicorn.error")
+        self.flushes = 0
+        self.writes = 0
+        self.skipped = 0
+
+    def renewed_expiry(self) -> datetime:
+        # Let Session.create decide units & timezone so both paths agree
+        return Session.create(self.expiration).expire_at
+
+    def needs_renewal(self, session: Session, target: datetime) -> bool:
+        expire_at = session.expire_at
+        if expire_at.tzinfo is None and target.tzinfo is not None:
+            expire_at = expire_at.replace(tzinfo=timezone.utc)
+
+        now = datetime.now(tz=target.tzinfo)
+        return (expire_at - now) < (target - now) * self.config.threshold
+
+    async def touch(self, session: Session) -> None:
+        if self.config.mode == "immediate":
+            await session.renew(self.expiration)
+            return
+
+        target = self.renewed_expiry()
+        if not self.needs_renewal(session, target):
+            self.skipped += 1
+            return
+
+        self.pending[session.id] = (session, target)
+
+    async def flush(self) -> None:
+        if len(self.pending) == 0:
+            return
+
+        pending, self.pending = self.pending, {}
+        operations = [
+            UpdateOne({"_id": session_id}, {"$set": {"expire_at": target}})
+            for session_id, (_, target) in pending.items()
+        ]
+
+        try:
+            await Session.get_motor_collection().bulk_write(operations, ordered=False)
+        except:
+            # Retry on the next flush, renewals queued meanwhile have the later target
+            for session_id, item in pending.items():
+                self.pending.setdefault(session_id, item)
+            raise
+
+        for session, target in pending.values():
+            session.expire_at = target
+        self.flushes += 1
+        self.writes += len(operations)
+
+    async def run(self) -> None:
+        while True:
+            await sleep(self.config.flush_interval)
+            try:
+                await self.flush()
+            except CancelledError:
+                raise
+            except:
+                self.logger.exception("Session renewal flush failed:")
+
+    def start(self) -> None:
+        if self.config.mode == "write_behind" and not self.task:
+            self.task = create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.config.mode,
+            "pending": len(self.pending),
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "skipped": self.skipped,
+        }
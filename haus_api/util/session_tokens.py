@@ -0,0 +1,171 @@
+import hmac
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from hashlib import sha256
+from logging import getLogger
+from secrets import token_hex, token_urlsafe
+from time import time
+from typing import Callable, NamedTuple, Optional
+from models import Session
+from .runtime_config import SessionTokenConfig
+
+TOKEN_VERSION = "v1"
+REVOCATION_CHANNEL = "haus.revocations"
+
+
+class SessionClaims(NamedTuple):
+    session_id: str
+    user_id: Optional[str]
+    expires: float
+    issued: float
+    # Expiry of the stored session when the token was issued
+    session_expires: float
+
+
+def _b64encode(data: bytes) -> str:
+    return urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class SessionTokenSigner:
+    def __init__(self, config: SessionTokenConfig, expiration) -> None:
+        self.config = config
+        self.expiration = expiration
+        secret = config.secret
+        if config.enabled and not secret:
+            getLogger("uvicorn.error").warning(
+                "runtime.session_tokens.secret is not set, using a random per-process key. Tokens will fall back to database checks across workers & restarts."
+            )
+            secret = token_urlsafe(32)
+        self.key = (secret or "").encode()
+        self.revoked_sessions: dict[str, float] = {}
+        self.revoked_users: dict[str, float] = {}
+
+        # Shares revocations with other workers when using a shared channels backend
+        self.worker = token_hex(8)
+        self.announce: Optional[Callable[[dict], None]] = None
+        self.verified = 0
+        self.refreshed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    def signature(self, payload: str) -> bytes:
+        return hmac.new(self.key, payload.encode(), sha256).digest()
+
+    def sign(self, session: Session) -> str:
+        now = time()
+        payload = _b64encode(
+            "|".join(
+                [
+                    session.id,
+                    session.user_id or "",
+                    f"{now + self.config.ttl:.0f}",
+                    f"{now:.6f}",
+                    f"{session.expire_at.timestamp():.0f}",
+                ]
+            ).encode()
+        )
+        return f"{TOKEN_VERSION}.{payload}.{_b64encode(self.signature(payload))}"
+
+    def parse(self, token: str) -> Optional[tuple[SessionClaims, bool]]:
+        parts = token.split(".")
+        if len(parts) != 3 or parts[0] != TOKEN_VERSION:
+            return None
+
+        try:
+            session_id, user_id, expires, issued, session_expires = (
+                _b64decode(parts[1]).decode().split("|")
+            )
+            claims = SessionClaims(
+                session_id,
+                user_id or None,
+                float(expires),
+                float(issued),
+                float(session_expires),
+            )
+            valid = hmac.compare_digest(self.signature(parts[1]), _b64decode(parts[2]))
+        except:
+            return None
+
+        return claims, valid
+
+    def trusted(self, claims: SessionClaims, valid: bool) -> bool:
+        if not valid:
+            self.rejected += 1
+            return False
+
+        if (
+            claims.expires - time() < self.config.ttl * self.config.refresh_threshold
+            or claims.session_expires < time()
+        ):
+            # Re-issued from the stored session
+            self.refreshed += 1
+            return False
+
+        if claims.issued <= self.revoked_sessions.get(claims.session_id, 0) or (
+            claims.user_id
+            and claims.issued <= self.revoked_users.get(claims.user_id, 0)
+        ):
+            self.rejected += 1
+            return False
+
+        self.verified += 1
+        return True
+
+    def session(self, claims: SessionClaims) -> Session:
+        return Session(
+            id=claims.session_id,
+            user_id=claims.user_id,
+            expire_at=datetime.fromtimestamp(claims.session_expires),
+        )
+
+    def prune(self, revoked: dict[str, float]) -> None:
+        cutoff = time() - self.config.ttl
+        for key in [k for k, v in revoked.items() if v < cutoff]:
+            del revoked[key]
+
+    def record(self, revoked: dict[str, float], key: str, at: float) -> None:
+        self.prune(revoked)
+        revoked[key] = max(revoked.get(key, 0), at)
+
+    def publish(self, op: str, **data) -> None:
+        if self.announce:
+            self.announce({"worker": self.worker, "op": op, **data})
+
+    def revoke(self, session_id: str) -> None:
+        now = time()
+        self.record(self.revoked_sessions, session_id, now)
+        self.publish("session", session=session_id, at=now)
+
+    def revoke_user(self, user_id: str) -> None:
+        now = time()
+        self.record(self.revoked_users, user_id, now)
+        self.publish("user", user=user_id, at=now)
+
+    def apply(self, message: dict) -> bool:
+        """Records a revocation announced by another worker, returns whether it was one."""
+        if message.get("worker") == self.worker:
+            return False
+
+        if message.get("op") == "session":
+            self.record(self.revoked_sessions, message["session"], message["at"])
+        elif message.get("op") == "user":
+            self.record(self.revoked_users, message["user"], message["at"])
+        else:
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "verified": self.verified,
+            "refreshed": self.refreshed,
+            "rejected": self.rejected,
+            "revoked": len(self.revoked_sessions) + len(self.revoked_users),
+        }
@@ -0,0 +1,244 @@
+from secrets import token_hex
+from typing import Callable, Iterable, Literal, NamedTuple, Optional, Union
+from urllib.parse import quote
+from .scopes import compile_scopes
+
+SUBSCRIBER_CHANNEL = "haus.subscribers"
+TOPIC_ROOTS = ("plugins", "users")
+ALL_TOPICS = "*"
+
+
+def topic_prefixes(topic: str) -> list[str]:
+    parts = topic.split(".")
+    return [".".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def topic_matches(topics: Optional[frozenset[str]], topic: Optional[str]) -> bool:
+    # Sessions without explicit topics follow everything, untopiced events go to everyone
+    if topics is None or topic is None:
+        return True
+    return any(prefix in topics for prefix in topic_prefixes(topic))
+
+
+def entity_topic(plugin_id: str, entity_id: str) -> str:
+    # Entity ids like "light.kitchen" stay one topic segment
+    segment = quote(str(entity_id), safe="").replace(".", "%2E")
+    return f"plugins.{plugin_id}.entities.{segment}"
+
+
+def topic_scope(topic: Optional[str]) -> Optional[str]:
+    if not topic:
+        return None
+
+    parts = topic.split(".")
+    if parts[0] == "plugins" and len(parts) > 1:
+        return f"app.plugins.{parts[1]}"
+    return None
+
+
+class SessionTarget(NamedTuple):
+    # Topic filters belong to each connection, see event_log.Listener
+    user_id: Optional[str]
+    scopes: tuple[str, ...]
+
+    def allowed(self, topic: Optional[str]) -> bool:
+        scope = topic_scope(topic)
+        return not scope or compile_scopes(self.scopes).has(scope)
+
+
+class SubscriberRegistry:
+    def __init__(self) -> None:
+        self.connections: dict[str, int] = {}
+        self.targets: dict[str, SessionTarget] = {}
+        self.user_sessions: dict[str, set[str]] = {}
+
+        # Sessions connected to other workers when using a shared channels backend
+        self.worker = token_hex(8)
+        self.announce: Optional[Callable[[dict], None]] = None
+        self.remote: dict[str, dict[str, SessionTarget]] = {}
+
+        # Ends the event streams of revoked local sessions
+        self.on_revoke: Optional[Callable[[list[str]], None]] = None
+
+    def _attach(self, session_id: str, target: SessionTarget) -> None:
+        self.targets[session_id] = target
+        if target.user_id:
+            self.user_sessions.setdefault(target.user_id, set()).add(session_id)
+
+    def _detach(self, session_id: str) -> Optional[SessionTarget]:
+        target = self.targets.pop(session_id, None)
+        if target and target.user_id in self.user_sessions:
+            self.user_sessions[target.user_id].discard(session_id)
+            if len(self.user_sessions[target.user_id]) == 0:
+                del self.user_sessions[target.user_id]
+        return target
+
+    def _publish(self, op: str, **data) -> None:
+        if self.announce:
+            self.announce({"worker": self.worker, "op": op, **data})
+
+    def _announce_session(self, session_id: str) -> None:
+        target = self.targets.get(session_id)
+        self._publish(
+            "session",
+            session=session_id,
+            connected=session_id in self.connections,
+            user=target.user_id if target else None,
+            scopes=list(target.scopes) if target else [],
+        )
+
+    def connect(
+        self, session_id: str, user_id: Optional[str], scopes: Iterable[str] = ()
+    ) -> None:
+        self.connections[session_id] = self.connections.get(session_id, 0) + 1
+        self._detach(session_id)
+        self._attach(session_id, SessionTarget(user_id, tuple(scopes)))
+        self._announce_session(session_id)
+
+    def disconnect(self, session_id: str) -> None:
+        remaining = self.connections.get(session_id, 0) - 1
+        if remaining > 0:
+            self.connections[session_id] = remaining
+            return
+
+        self.connections.pop(session_id, None)
+        self._detach(session_id)
+        self._announce_session(session_id)
+
+    def set_user(
+        self, session_id: str, user_id: Optional[str], scopes: Iterable[str] = ()
+    ) -> None:
+        if session_id in self.connections:
+            self._detach(session_id)
+            self._attach(session_id, SessionTarget(user_id, tuple(scopes)))
+            self._announce_session(session_id)
+
+    def _set_scopes(self, user_id: str, scopes: tuple[str, ...]) -> None:
+        for session_id in self.user_sessions.get(user_id, ()):
+            self.targets[session_id] = self.targets[session_id]._replace(scopes=scopes)
+
+        for sessions in self.remote.values():
+            for session_id, target in sessions.items():
+                if target.user_id == user_id:
+                    sessions[session_id] = target._replace(scopes=scopes)
+
+    def set_scopes(self, user_id: str, scopes: Iterable[str]) -> None:
+        scopes = tuple(scopes)
+        self._set_scopes(user_id, scopes)
+        self._publish("scopes", user=user_id, scopes=list(scopes))
+
+    def remove_user(self, user_id: str) -> None:
+        self._remove_user(user_id)
+        self._publish("remove_user", user=user_id)
+
+    def _remove_user(self, user_id: str) -> None:
+        sessions = self.user_sessions.pop(user_id, set())
+        for session_id in sessions:
+            self.targets[session_id] = SessionTarget(None, ())
+        self._revoke(sessions)
+
+        for sessions in self.remote.values():
+            for session_id, target in sessions.items():
+                if target.user_id == user_id:
+                    sessions[session_id] = SessionTarget(None, ())
+
+    def revoke(self, session_ids: list[str]) -> None:
+        self._revoke(session_ids)
+        self._publish("revoke", sessions=list(session_ids))
+
+    def _revoke(self, session_ids: Iterable[str]) -> None:
+        local = [s for s in session_ids if s in self.connections]
+        if self.on_revoke and len(local) > 0:
+            self.on_revoke(local)
+
+    def check_topics(
+        self, session_id: str, topics: list[str]
+    ) -> tuple[list[str], list[str]]:
+        """Splits topics into those the session may follow and those that are unknown or not permitted."""
+        target = self.targets.get(session_id)
+        if not target:
+            return [], topics
+
+        index = compile_scopes(target.scopes)
+        accepted, rejected = [], []
+        for topic in topics:
+            scope = topic_scope(topic)
+            if topic != ALL_TOPICS and (
+                topic.split(".")[0] not in TOPIC_ROOTS
+                or (scope and not index.has(scope))
+            ):
+                rejected.append(topic)
+            else:
+                accepted.append(topic)
+        return accepted, rejected
+
+    def sync(self) -> None:
+        self._publish("sync")
+
+    def leave(self) -> None:
+        self._publish("leave")
+
+    def apply(self, message: dict) -> None:
+        worker = message.get("worker")
+        if worker == self.worker:
+            return
+
+        op = message.get("op")
+        if op == "session":
+            sessions = self.remote.setdefault(worker, {})
+            if message["connected"]:
+                sessions[message["session"]] = SessionTarget(
+                    message["user"], tuple(message.get("scopes") or ())
+                )
+            else:
+                sessions.pop(message["session"], None)
+        elif op == "scopes":
+            self._set_scopes(message["user"], tuple(message["scopes"]))
+        elif op == "remove_user":
+            self._remove_user(message["user"])
+        elif op == "revoke":
+            self._revoke(message["sessions"])
+        elif op == "sync":
+            for session_id in self.connections:
+                self._announce_session(session_id)
+        elif op == "leave":
+            self.remote.pop(worker, None)
+
+    def channels(
+        self,
+        user_ids: Union[list[str], Literal["*"]] = "*",
+        topic: Optional[str] = None,
+        local: bool = False,
+    ) -> list[str]:
+        if user_ids == "*":
+            candidates = {
+                s for sessions in self.user_sessions.values() for s in sessions
+            }
+        else:
+            candidates = {
+                s
+                for user_id in set(user_ids)
+                for s in self.user_sessions.get(user_id, ())
+            }
+        found = {s for s in candidates if self.targets[s].allowed(topic)}
+
+        if not local:
+            users = None if user_ids == "*" else set(user_ids)
+            for sessions in self.remote.values():
+                found.update(
+                    s
+                    for s, target in sessions.items()
+                    if target.user_id
+                    and (users is None or target.user_id in users)
+                    and target.allowed(topic)
+                )
+        return list(found)
+
+    def stats(self) -> dict:
+        return {
+            "connections": sum(self.connections.values()),
+            "sessions": len(self.connections),
+            "users": len(self.user_sessions),
+            "remote_workers": len(self.remote),
+            "remote_sessions": sum(len(s) for s in self.remote.values()),
+        }
@@ -169,12 +169,22 @@ export function useEvent<T extends object>(
     const handleEvent = useCallback(
         (ev: MessageEvent) => {
             try {
-                const evData: ApiEvent<T> = JSON.parse(ev.data);
-                if (
-                    evData.code === event &&
-                    (!filter || isMatch(evData.data, filter))
-                ) {
-                    handler(evData);
+                const evData: ApiEvent = JSON.parse(ev.data);
+                const events: ApiEvent<T>[] =
+                    evData.code === "plugin.events"
+                        ? evData.data.events.map((data: T) => ({
+                              id: evData.id,
+                              code: "plugin.event",
+                              data,
+                          }))
+                        : [evData];
+                for (const item of events) {
+                    if (
+                        item.code === event &&
+                        (!filter || isMatch(item.data, filter))
+                    ) {
+                        handler(item);
+                    }
                 }
             } catch {}
         },
@@ -91,12 +91,22 @@ export function ApiProvider({
 
     useEffect(() => {
         if (apiState.user && apiState.session) {
-            setSocket(
-                new WebSocket(
-                    `wss://${location.host}/api/events/${apiState.session.id}`
-                )
+            const newSocket = new WebSocket(
+                `wss://${location.host}/api/events/${apiState.session.id}`
             );
 
+            // Answer server heartbeats, otherwise the connection is closed as idle
+            newSocket.addEventListener("message", (event) => {
+                try {
+                    if (JSON.parse(event.data).code === "events.heartbeat") {
+                        newSocket.send("{}");
+                    }
+                } catch {
+                    // Not a JSON event, e.g. a binary encoding
+                }
+            });
+            setSocket(newSocket);
+
             return () => {
                 if (socket) {
                     socket.close();